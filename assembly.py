@@ -0,0 +1,252 @@
+"""Module containing an engine for assembling magic squares from the border
+pairs of one candidate. Each pair (A,B) with A + B = k is described by its
+offset d = k/2 - A = B - k/2 from the middle number. For corner pairs with
+offsets d1 > d2, the top of the square is k/2 + d1 + d2 and the left side is
+k/2 + d1 - d2, so each is a border square exactly when d1 + d2 or d1 - d2
+is another offset. Every such match is a triple of offsets d3 = d1 + d2,
+which is the ordering a3 < a1 < a2 derived in the README. The triples are
+found by looking up the sums of offsets in an index, and all fits follow
+from the triples alone, instead of looking up both sides of every
+arrangement of corners as getbestsquare does."""
+
+import numpy as np
+
+import backend
+import residues
+
+
+def _offsetindex(offsets):
+    """Return a function looking up an array of values in the offsets, and
+    returning for each the position of a candidate match in offsets and
+    whether it matched. The offsets need not be sorted, since they are not
+    once reduced mod 2^64; they are searched through a sorted copy. A bitmap
+    of the high bits of each offset rules out most values before the
+    search."""
+    order = np.argsort(offsets, kind="stable")
+    ascending = offsets[order]
+    n = len(offsets)
+    shift = np.uint64(64 - min(24, n.bit_length() + 6))
+    bitmap = np.zeros(1 << (64 - int(shift)), dtype=bool)
+    bitmap[ascending.astype(np.uint64) >> shift] = True
+    def lookup(x):
+        pos = np.zeros(len(x), dtype=np.intp)
+        found = bitmap[x.astype(np.uint64) >> shift]
+        maybe = np.flatnonzero(found)
+        pos[maybe] = np.minimum(np.searchsorted(ascending, x[maybe]), n - 1)
+        found[maybe] = ascending[pos[maybe]] == x[maybe]
+        return order[pos], found
+    return lookup
+
+
+def _blocks(firstj, n):
+    """Generator of arrays i, j listing every pair of indices with
+    firstj[i] <= j < n, in order, in blocks of about 2^20 pairs."""
+    counts = np.maximum(n - firstj, 0)
+    cumulative = np.cumsum(counts)
+    first = 0
+    while first < len(firstj):
+        last = int(np.searchsorted(cumulative, cumulative[first] - counts[first] + 2**20, side="right"))
+        last = min(len(firstj), max(last, first + 1))
+        rowcounts = counts[first:last]
+        i = np.repeat(np.arange(first, last), rowcounts)
+        starts = np.cumsum(rowcounts) - rowcounts
+        j = np.arange(len(i)) - np.repeat(starts, rowcounts) + np.repeat(firstj[first:last], rowcounts)
+        yield i, j
+        first = last
+
+
+class _Computed:
+    """Read-only sequence of n items, each computed by func(i) when read."""
+
+    def __init__(self, func, n):
+        self.func = func
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        return self.func(i)
+
+
+def rootoffsets(roots, k):
+    """Given an int64 array of the roots a of the smaller squares of the
+    border pairs of k, in increasing order, return a tuple d,exact where d
+    holds the offsets k/2 - a^2 as triples() would reduce them, found with
+    machine arithmetic instead of Python integers."""
+    a = roots.astype(np.uint64)
+    with np.errstate(over="ignore"):
+        d = np.uint64((k // 2) % 2**64) - a * a
+    exact = 2 * (k // 2 - int(roots[0]) ** 2) < 2**63
+    return (d.astype(np.int64) if exact else d), exact
+
+
+def triples(offsets, reduced=None):
+    """Given distinct positive integers in decreasing order, return a list of
+    every triple of indices (h,i,j) with h < i <= j and
+    offsets[h] == offsets[i] + offsets[j]. If reduced is the tuple d,exact
+    that rootoffsets returns for them, it is used instead of converting the
+    offsets, and offsets are only read to check matches."""
+    n = len(offsets)
+    if n < 2:
+        return []
+    # Exact machine integers if the sums fit, otherwise sums mod 2^64 which
+    # are checked exactly afterwards
+    if reduced is not None:
+        d, exact = reduced
+    else:
+        exact = 2 * offsets[0] < 2**63
+        if exact:
+            d = np.array([int(x) for x in offsets], dtype=np.int64)
+        else:
+            d = np.array([int(x) % 2**64 for x in offsets], dtype=np.uint64)
+    lookup = _offsetindex(d)
+    if exact:
+        # Sums above the largest offset can't match, so row i only needs the
+        # columns j with offsets[j] <= offsets[0] - offsets[i]
+        firstj = np.searchsorted(-d, d - d[0])
+    else:
+        firstj = np.zeros(n, dtype=np.intp)
+    firstj = np.maximum(firstj, np.arange(n))
+    found = []
+    with np.errstate(over="ignore"):
+        for i,j in _blocks(firstj, n):
+            h, hit = lookup(d[i] + d[j])
+            for c in np.flatnonzero(hit).tolist():
+                found.append((int(h[c]), int(i[c]), int(j[c])))
+    if not exact:
+        checked = []
+        for h,i,j in found:
+            total = offsets[i] + offsets[j]
+            if offsets[h] != total:
+                # Another offset may share the residue of the true match
+                same = [x for x in np.flatnonzero(d == d[h]).tolist() if offsets[x] == total]
+                if not same:
+                    continue
+                h = same[0]
+            checked.append((h, i, j))
+        found = checked
+    return found
+
+
+def _square(asquares, k, x, y):
+    """The square with corners (A_x, k - A_x) and (A_y, k - A_y), x < y."""
+    middle = k // 2
+    total = k * 3 // 2
+    top = total - asquares[x] - asquares[y]
+    left = middle - asquares[x] + asquares[y]
+    return [
+        [int(asquares[x]),     int(top),                  int(asquares[y])          ],
+        [int(left),            int(middle),               int(total - middle - left)],
+        [int(k - asquares[y]), int(total - middle - top), int(k - asquares[x])      ]
+    ]
+
+
+def assemble(asquares, k, roots=None):
+    """Given the smaller squares A of the border pairs (A, k - A) of one
+    candidate, in any order, find the best square as getbestsquare does,
+    with the same result. The triples are found in increasing order of A,
+    and ties between arrangements are broken in the order given. Return a tuple
+    fit,square,hourglasses,squares,cells where fit and square are as in
+    getbestsquare, hourglasses and squares are the numbers of arrangements
+    of corners with fit 1 and 2, and cells is the number of perfect squares
+    among the nine cells of the square returned (5 if none). If roots is an
+    int64 array of the square roots of A in increasing order, asquares may
+    be None, and only the squares and offsets that are needed are computed
+    from it."""
+    if roots is None:
+        # order[x] is the index in asquares of the x-th smallest A
+        order = sorted(range(len(asquares)), key=asquares.__getitem__)
+        offsets = [k // 2 - asquares[x] for x in order]
+        reduced = None
+    else:
+        order = range(len(roots))
+        asquares = _Computed(lambda i: int(roots[i]) ** 2, len(roots))
+        offsets = _Computed(lambda i: k // 2 - int(roots[i]) ** 2, len(roots))
+        reduced = rootoffsets(roots, k)
+    fits = {}
+    for h,i,j in triples(offsets, reduced):
+        # Corners i,j complete the top and bottom; corners h,i and h,j
+        # complete the left and right. If i == j, only the left and right of
+        # corners h,i are completed.
+        for x,y in ({(i, j), (h, i), (h, j)} if i != j else [(h, i)]):
+            corners = (min(order[x], order[y]), max(order[x], order[y]))
+            fits[corners] = fits.get(corners, 0) + 1
+    if not fits:
+        return 0, None, 0, 0, 5
+    bestfit = max(fits.values())
+    square = _square(asquares, k, *min(c for c,fit in fits.items() if fit == bestfit))
+    cells = sum(1 for row in square for n in row if backend.is_square(n))
+    hourglasses = sum(1 for fit in fits.values() if fit == 1)
+    return bestfit, square, hourglasses, len(fits) - hourglasses, cells
+
+
+# Moduli of the residues each pair carries for squarecells, and tables of
+# the squares mod each factor of them. Cells are odd and their residues mod
+# the primes 1 mod 4 dividing m are skewed, so only 9 and primes 3 mod 4
+# are used. About 1 in 200 cells that are not squares pass them all.
+CELL_MODULI = [
+    (9 * 7 * 11 * 19 * 23 * 31, [9, 7, 11, 19, 23, 31]),
+    (43 * 47 * 59 * 67 * 71 * 79, [43, 47, 59, 67, 71, 79]),
+]
+_SQUARETABLES = {q: residues.squares(q) for modulus,factors in CELL_MODULI for q in factors}
+
+
+def _maybesquare(cellres):
+    """Given arrays of residues of some integers mod each modulus in
+    CELL_MODULI, return a boolean array which is False where an integer is
+    certainly not a perfect square."""
+    maybe = np.ones(len(cellres[0]), dtype=bool)
+    for (modulus,factors),r in zip(CELL_MODULI, cellres):
+        for q in factors:
+            maybe &= _SQUARETABLES[q][r % np.uint64(q)]
+    return maybe
+
+
+def squarecells(asquares, k):
+    """Given the smaller squares A of the border pairs (A, k - A) of one
+    candidate, in increasing order, find the arrangement of corners whose
+    square has the most perfect squares among its nine cells, not only
+    those completed by other border pairs. Return a tuple cells,square for
+    the first such arrangement in the order getbestsquare tries them, or
+    5,None if there are fewer than two pairs.
+
+    Each pair carries its residues mod the moduli in CELL_MODULI, so the
+    top, bottom, left and right of every arrangement are first tested for
+    squareness with NumPy on machine words, and only the few cells passing
+    every residue test are checked exactly."""
+    n = len(asquares)
+    if n < 2:
+        return 5, None
+    middle = k // 2
+    total = k * 3 // 2
+    a = [np.array([int(x) % modulus for x in asquares], dtype=np.uint64) for modulus,_ in CELL_MODULI]
+    # Every arrangement has at least the middle and corners
+    best, bestcells = (0, 1), 5
+    for i,j in _blocks(np.arange(1, n + 1), n):
+        # Cells in the order top, bottom, left, right; bottom = k - top and
+        # right = k - left
+        cellres = []
+        for (modulus,_),r in zip(CELL_MODULI, a):
+            m = np.uint64(modulus)
+            top = (np.uint64(total % modulus) + 2 * m - r[i] - r[j]) % m
+            left = (np.uint64(middle % modulus) + m - r[i] + r[j]) % m
+            kk = np.uint64(k % modulus)
+            cellres.append([top, (kk + m - top) % m, left, (kk + m - left) % m])
+        maybe = [_maybesquare([res[c] for res in cellres]) for c in range(4)]
+        upper = maybe[0].astype(np.int8) + maybe[1] + maybe[2] + maybe[3]
+        # Only arrangements that might beat the best so far are checked
+        for c in np.flatnonzero(upper + 5 > bestcells).tolist():
+            x, y = int(i[c]), int(j[c])
+            top = total - asquares[x] - asquares[y]
+            left = middle - asquares[x] + asquares[y]
+            cells = 5 + sum(bool(maybe[cell][c]) and bool(backend.is_square(value))
+                            for cell,value in enumerate([top, k - top, left, k - left]))
+            if cells > bestcells:
+                bestcells, best = cells, (x, y)
+    return bestcells, _square(asquares, k, *best)
+
+
+def bestsquare(asquares, k, roots=None):
+    """Return only fit,square from assemble."""
+    return assemble(asquares, k, roots)[:2]
@@ -0,0 +1,57 @@
+"""Module choosing the big integer arithmetic used on the hot paths of the
+search. If gmpy2 is installed, its mpz integers are used, which are faster
+than Python's built-in integers for the multi-limb numbers involved once
+r22 is large. Otherwise, built-in integers are used. The choice can be
+forced by setting the environment variable PARKERSQUARE_BACKEND to
+'gmpy2' or 'python' before this module is first imported."""
+
+import os
+import math
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+
+def _residues(m):
+    """Table t of length m with t[r] true exactly when r is a square mod m."""
+    table = bytearray(m)
+    for i in range(m):
+        table[i * i % m] = 1
+    return bytes(table)
+
+# Squares mod 64, 63, 65 and 11. Only about 1 in 120 non-squares gets past
+# all four tables. The last three are found from one reduction mod 45045.
+_SQUARES64 = _residues(64)
+_SQUARES63 = _residues(63)
+_SQUARES65 = _residues(65)
+_SQUARES11 = _residues(11)
+
+
+def _is_square_filtered(n):
+    """Return True if n is a perfect square. Most non-squares are rejected by
+    their residues mod small numbers before the exact square root is taken."""
+    if n < 0 or not _SQUARES64[n & 63]:
+        return False
+    r = n % 45045  # 63 * 65 * 11
+    if not (_SQUARES63[r % 63] and _SQUARES65[r % 65] and _SQUARES11[r % 11]):
+        return False
+    return math.isqrt(n) ** 2 == n
+
+
+NAME = os.environ.get("PARKERSQUARE_BACKEND", "gmpy2" if gmpy2 is not None else "python")
+
+if NAME == "gmpy2":
+    if gmpy2 is None:
+        raise ImportError("PARKERSQUARE_BACKEND is gmpy2 but gmpy2 is not installed.")
+    mpz = gmpy2.mpz
+    isqrt = gmpy2.isqrt
+    # GMP already rejects by residues before taking a square root
+    is_square = gmpy2.is_square
+elif NAME == "python":
+    mpz = int
+    isqrt = math.isqrt
+    is_square = _is_square_filtered
+else:
+    raise ImportError(f"Unknown PARKERSQUARE_BACKEND {NAME}.")
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""Benchmarks for each stage of checking a candidate middle number: factor
+r22, decompose its primes, generate the pairs of squares surrounding the
+middle, and assemble them into a square. Each stage is timed separately on
+fixed workloads of increasing size, along with the throughput of checking
+an interval with several workers of each executor, giving the scaling of
+processes and threads. Results are written as JSON and can be compared
+against a stored baseline to catch regressions. Running once with
+PARKERSQUARE_BACKEND=python and once with PARKERSQUARE_BACKEND=gmpy2, then
+comparing with --all, shows the speedup of gmpy2 at each tier."""
+
+import os
+import sys
+import json
+import time
+import timeit
+import random
+import argparse
+import platform
+import itertools
+
+import backend
+import factors
+import parkersquare
+
+
+###############################################################################
+
+# Factorizations of r22 for each magnitude tier. The small and medium tiers
+# are the first candidates above a starting point, the large tier are
+# candidates with many factors taken from the logs in runs/.
+def _firstcandidates(start, count):
+    return list(itertools.islice(parkersquare.iter_middle_range(start, start + 100 * count), count))
+
+WORKLOADS = {
+    "small": lambda: _firstcandidates(10**5, 200),
+    "medium": lambda: _firstcandidates(10**8, 200),
+    "large": lambda: [
+        {5:4, 13:3, 17:2, 29:2},
+        {5:4, 13:4, 17:4, 29:3},
+        {5:4, 13:4, 17:3, 29:4},
+        {5:4, 13:4, 17:4, 29:2, 37:1},
+        {5:4, 13:4, 17:3, 29:3, 37:1},
+        {5:4, 13:4, 17:4, 29:1, 37:2},
+        {5:4, 13:4, 17:1, 29:4, 37:2},
+        {5:4, 13:4, 17:2, 29:2, 37:3},
+    ],
+}
+
+# Primes congruent to 1 mod 4 to decompose into two squares, for each tier
+PRIMES = {
+    "small": lambda: list(itertools.islice(factors.primes1mod4(10**5), 200)),
+    "medium": lambda: list(itertools.islice(factors.primes1mod4(10**9), 200)),
+    "large": lambda: list(itertools.islice(factors.primes1mod4(10**12), 200)),
+}
+
+
+def _twicesquared(fac):
+    """Prime factorization of 2m^2 from that of m."""
+    fac = {p:2*e for p,e in fac.items()}
+    fac[2] = fac.get(2, 0) + 1
+    return fac
+
+
+def stages(workload, primes):
+    """Return a dictionary of stage name to a function running that stage
+    once over every item of the workload."""
+    nums = [factors.getnum(fac) for fac in workload]
+    ks = [_twicesquared(fac) for fac in workload]
+    pairs = [parkersquare.getborderpairs(fac) for fac in workload]
+    pairs = [p for p in pairs if p is not None]
+    compact = [parkersquare.getborderpairs(fac, compact=True) for fac in workload]
+    compact = [p for p in compact if p is not None]
+    return {
+        "factorize1mod4": lambda: [factors.factorize1mod4(n) for n in nums],
+        "_primesumsquares": lambda: [factors._primesumsquares.__wrapped__(p) for p in primes],
+        "getsumsquares": lambda: [parkersquare.getsumsquares(k) for k in ks],
+        "getborderpairs": lambda: [parkersquare.getborderpairs(fac) for fac in workload],
+        "getbestsquare": lambda: [parkersquare.getbestsquare(p) for p in pairs],
+        "getbestsquare_compact": lambda: [parkersquare.getbestsquare(p) for p in compact],
+        "check_middle": lambda: [parkersquare.check_middle(fac) for fac in workload],
+    }
+
+
+def timeit_best(func, mintime=0.2, repeat=3):
+    """Return the best time in seconds for one call of func, calling it
+    enough times for each measurement to take at least mintime seconds."""
+    timer = timeit.Timer(func)
+    # The calibration run counts as the first measurement
+    number, elapsed = timer.autorange()
+    best = elapsed / number
+    number = max(1, int(number * mintime / elapsed))
+    if repeat > 1:
+        best = min(best, min(timer.repeat(repeat=repeat - 1, number=number)) / number)
+    return best
+
+
+def search_throughput(procs, start=10**7, length=4 * 10**5, executor="process"):
+    """Return the number of candidates per second checked by procs workers of
+    the given executor (see parkersquare.make_pool) splitting the interval
+    [start, start + length) as search() would."""
+    pieces = 8 * procs
+    bounds = [start + length * i // pieces for i in range(pieces + 1)]
+    pool = parkersquare.make_pool(executor, procs)
+    try:
+        begin = time.perf_counter()
+        results = pool.starmap(parkersquare.check_range, zip(bounds, bounds[1:]))
+        elapsed = time.perf_counter() - begin
+    finally:
+        pool.terminate()
+        pool.join()
+    return sum(r[2] for r in results) / elapsed
+
+
+def square_filter(bits=110, count=10**5, seed=1):
+    """Time backend.is_square against a plain exact square root on count
+    random integers of the given size, about 1% of which are squares.
+    Return a dictionary with the fraction rejected by residues alone and
+    the seconds per call of each test."""
+    rng = random.Random(seed)
+    nums = [rng.getrandbits(bits) for _ in range(count)]
+    nums[::100] = [rng.getrandbits(bits // 2) ** 2 for _ in nums[::100]]
+    nums = [backend.mpz(n) for n in nums]
+    def plain():
+        return [(n >= 0) and (backend.isqrt(n) ** 2 == n) for n in nums]
+    def filtered():
+        return [backend.is_square(n) for n in nums]
+    if plain() != filtered():
+        raise AssertionError("is_square disagrees with the exact square root")
+    passed = sum(1 for n in nums
+                 if backend._SQUARES64[n % 64] and backend._SQUARES63[n % 63]
+                 and backend._SQUARES65[n % 65] and backend._SQUARES11[n % 11])
+    return {
+        "rejected": 1 - passed / count,
+        "is_square": timeit_best(filtered) / count,
+        "isqrt": timeit_best(plain) / count,
+    }
+
+
+def run(procs=None, quick=False, executors=("process",)):
+    """Run every benchmark, returning the results as a dictionary. Stage
+    timings are in seconds per item, throughput in candidates per second.
+    Throughput is measured for each executor in executors, at each number of
+    workers in procs, except that "inline" always has one worker."""
+    results = {}
+    print(f"Big integer backend: {backend.NAME}", flush=True)
+    for tier in WORKLOADS:
+        workload = WORKLOADS[tier]()
+        primes = PRIMES[tier]()
+        for name,func in stages(workload, primes).items():
+            count = len(primes) if name == "_primesumsquares" else len(workload)
+            seconds = timeit_best(func, repeat=1 if quick else 3)
+            results[f"{name}/{tier}"] = seconds / count
+            print(f"{name:>18} {tier:>6}: {seconds / count * 1e6:12.2f} us", flush=True)
+    for bits in [64, 110, 200]:
+        result = square_filter(bits, 10**4 if quick else 10**5)
+        results[f"is_square/{bits}bits"] = result["is_square"]
+        print(f"{'is_square':>18} {bits:>6}: {result['is_square'] * 1e6:12.2f} us"
+              f" (isqrt {result['isqrt'] * 1e6:.2f} us, {result['rejected']:.1%} rejected)", flush=True)
+    procs = procs or [1, 2, 4, os.cpu_count()]
+    for executor in executors:
+        for n in ([1] if executor == "inline" else sorted(set(procs))):
+            rate = search_throughput(n, length=10**5 if quick else 4 * 10**5, executor=executor)
+            # Process pools keep the names they had before there was a choice
+            name = f"search/{n}procs" if executor == "process" else f"search/{executor}/{n}procs"
+            results[name] = rate
+            print(f"{'search ' + executor:>18} {n:>6}: {rate:12.1f} candidates/s", flush=True)
+    return {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "backend": backend.NAME,
+        "results": results,
+    }
+
+
+def compare(baseline, current, tolerance=0.2):
+    """Compare two sets of results from run(). Return a list of tuples
+    (name, baseline, current, change) for every result that is worse than the
+    baseline by more than the given fraction. Throughput results are worse
+    when lower, timings are worse when higher. A tolerance of None returns
+    every result."""
+    regressions = []
+    for name,old in baseline["results"].items():
+        new = current["results"].get(name)
+        if new is None:
+            continue
+        if name.startswith("search/"):
+            change = old / new - 1
+        else:
+            change = new / old - 1
+        if (tolerance is None) or (change > tolerance):
+            regressions.append((name, old, new, change))
+    return regressions
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the Parker square search.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    runparser = sub.add_parser("run", help="run the benchmarks")
+    runparser.add_argument("--output", default="bench_results.json",
+                           help="file to write results to (default: bench_results.json)")
+    runparser.add_argument("--procs", type=int, nargs="*", default=None,
+                           help="process counts for search throughput (default: 1 2 4 all)")
+    runparser.add_argument("--quick", action="store_true",
+                           help="shorter measurements, for a rough check")
+    runparser.add_argument("--executors", nargs="*", choices=parkersquare.EXECUTORS,
+                           default=parkersquare.EXECUTORS,
+                           help="executors whose throughput is measured (default: all)")
+    squaresparser = sub.add_parser("squares", help="benchmark the perfect square test")
+    squaresparser.add_argument("--bits", type=int, nargs="*", default=[64, 110, 200],
+                               help="sizes of the integers tested (default: 64 110 200)")
+    compareparser = sub.add_parser("compare", help="compare results to a baseline")
+    compareparser.add_argument("baseline", help="baseline results file")
+    compareparser.add_argument("current", help="new results file")
+    compareparser.add_argument("--tolerance", type=float, default=0.2,
+                               help="allowed fractional slowdown (default: 0.2)")
+    compareparser.add_argument("--all", action="store_true",
+                               help="show the change in every result")
+    args = parser.parse_args()
+    if args.command == "run":
+        results = run(args.procs, args.quick, args.executors)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    elif args.command == "squares":
+        print(f"Big integer backend: {backend.NAME}")
+        for bits in args.bits:
+            result = square_filter(bits)
+            print(f"{bits} bits: {result['rejected']:.2%} rejected by residues,",
+                  f"is_square {result['is_square'] * 1e9:.0f} ns,",
+                  f"isqrt {result['isqrt'] * 1e9:.0f} ns")
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        print(f"Backends: {baseline.get('backend')} -> {current.get('backend')}")
+        if args.all:
+            for name,old,new,change in compare(baseline, current, None):
+                print(f"{name}: {old:.4g} -> {new:.4g} ({change:+.0%})")
+        regressions = compare(baseline, current, args.tolerance)
+        for name,old,new,change in regressions:
+            print(f"REGRESSION {name}: {old:.4g} -> {new:.4g} ({change:+.0%})")
+        if not regressions:
+            print("No regressions.")
+        sys.exit(1 if regressions else 0)
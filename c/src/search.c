@@ -2,6 +2,8 @@
 // surrounding the middle number of a magic square and see if they can
 // be assembled into a magic square of squares
 #include <stddef.h>
+#include <stdbool.h>
+#include <stdlib.h>
 #include <gmp.h>
 
 #include "primes.h"
@@ -9,14 +11,101 @@
 #include "search.h"
 
 /*
-Given the prime factorization of the square root of the 
+Compare two pair_t by their first elements, for qsort.
+*/
+static int pair_cmp_first(const void *x, const void *y) {
+    return mpz_cmp(((const pair_t *)x)->first, ((const pair_t *)y)->first);
+}
+
+/*
+Return true if n is one of the values in the sorted pairs, whose elements
+all sum to k. n is a second element exactly when k - n is a first element,
+so only the first elements need to be searched.
+*/
+static bool inpairs(const mpz_t n, const mpz_t k, const pair_t *pairs, size_t numpairs, mpz_t tmp) {
+    size_t lo, hi, mid;
+    int pass, c;
+    for (pass = 0; pass < 2; pass++) {
+        if (pass == 0) {
+            mpz_set(tmp, n);
+        } else {
+            mpz_sub(tmp, k, n);
+        }
+        lo = 0;
+        hi = numpairs;
+        while (lo < hi) {
+            mid = lo + (hi - lo) / 2;
+            c = mpz_cmp(pairs[mid].first, tmp);
+            if (c == 0) {
+                return true;
+            } else if (c < 0) {
+                lo = mid + 1;
+            } else {
+                hi = mid;
+            }
+        }
+    }
+    return false;
+}
+
+/*
+Given the prime factorization of the square root of the middle number, and
+the pairs of squares (a,b) with a < b surrounding the middle number, sorted
+by a, try every two pairs as the corners of a magic square. Store the best
+square found in 'square', an array of 9 initialized mpz_t in row-major
+order. Return 2 if a full magic square was found, 1 if only an 'hourglass'
+(one of the middle row or middle column is made of squares), and 0 if
+neither. This mirrors getbestsquare() in parkersquare.py, trying the corner
+pairs in the same order, so that both find the same square.
 */
 int constructsquare(
     mpz_t *square,
     const primefactor_t *rootmidfac, size_t numfac,
     const pair_t *outerpairs, size_t numpairs)
 {
-    return 0;
+    mpz_t k, total, middle, top, left, tmp;
+    size_t i, j;
+    int bestfit = 0, numfit;
+    (void)rootmidfac;
+    (void)numfac;
+
+    if (numpairs < 4) {
+        return 0;
+    }
+    mpz_inits(k, total, middle, top, left, tmp, NULL);
+    // Common sum of the square and the middle number
+    mpz_add(k, outerpairs[0].first, outerpairs[0].second);
+    mpz_mul_ui(total, k, 3);
+    mpz_fdiv_q_ui(total, total, 2);
+    mpz_fdiv_q_ui(middle, total, 3);
+    for (i = 0; i < numpairs && bestfit < 2; i++) {
+        const pair_t *c1 = &outerpairs[i];
+        for (j = i + 1; j < numpairs && bestfit < 2; j++) {
+            const pair_t *c2 = &outerpairs[j];
+            mpz_sub(top, total, c1->first);
+            mpz_sub(top, top, c2->first);
+            mpz_sub(left, total, c1->first);
+            mpz_sub(left, left, c2->second);
+            numfit = inpairs(left, k, outerpairs, numpairs, tmp)
+                   + inpairs(top, k, outerpairs, numpairs, tmp);
+            if (numfit > bestfit) {
+                bestfit = numfit;
+                mpz_set(square[0], c1->first);
+                mpz_set(square[1], top);
+                mpz_set(square[2], c2->first);
+                mpz_set(square[3], left);
+                mpz_set(square[4], middle);
+                mpz_sub(square[5], total, middle);
+                mpz_sub(square[5], square[5], left);
+                mpz_set(square[6], c2->second);
+                mpz_sub(square[7], total, middle);
+                mpz_sub(square[7], square[7], top);
+                mpz_set(square[8], c1->second);
+            }
+        }
+    }
+    mpz_clears(k, total, middle, top, left, tmp, NULL);
+    return bestfit;
 }
 
 /*
@@ -73,8 +162,8 @@ size_t square_filter(pair_t *pairs, size_t len) {
 Find a parker square whose middle number's square root is given by the prime
 factorization rootmidfac, with numfac factors. Store the square, if it exists,
 in 'square', which should point to an array of mpz_t with length 9. The square
-will be stored in row-major order. The return value will be nonzero if any
-interesting squares are found. 
+will be stored in row-major order. The return value is 2 if a full magic
+square is found, 1 for an 'hourglass', and 0 otherwise (see constructsquare).
 */
 int findparkersquare(
     mpz_t *square, 
@@ -96,9 +185,10 @@ int findparkersquare(
     borderpairs = (pair_t *)malloc(numpairs * sizeof(pair_t));
     pair_array_init(borderpairs, numpairs);
     getsumsquares(borderpairs, pairsum, pairsumlen);
-    // square the pairs and filter to just strictly ordered
+    // square the pairs, filter to just strictly ordered, and sort
     numpairs = square_filter(borderpairs, numpairs);
-    
+    qsort(borderpairs, numpairs, sizeof(pair_t), pair_cmp_first);
+
     // Assemble pairs into square
     found = constructsquare(square, rootmidfac, numfac, borderpairs, numpairs);
 
@@ -108,4 +198,54 @@ int findparkersquare(
     free(pairsum);
 
     return found;
-}
\ No newline at end of file
+}
+
+/*
+Check count candidates at once. The prime factorizations of the square roots
+of their middle numbers are stored one after another in facs, with lens[i]
+the number of factors of candidate i. Store in fits[i] the value
+findparkersquare returns for candidate i. Return the number of candidates
+with a nonzero fit, whose squares can then be found with
+findparkersquare_str.
+*/
+size_t findparkersquares(int *fits, const primefactor_t *facs, const size_t *lens, size_t count) {
+    mpz_t square[9];
+    size_t i, nfound = 0;
+    for (i = 0; i < 9; i++) {
+        mpz_init(square[i]);
+    }
+    for (i = 0; i < count; i++) {
+        fits[i] = findparkersquare(square, facs, lens[i]);
+        nfound += (fits[i] > 0);
+        facs += lens[i];
+    }
+    for (i = 0; i < 9; i++) {
+        mpz_clear(square[i]);
+    }
+    return nfound;
+}
+
+/*
+Like findparkersquare, but store the square as 9 space-separated decimal
+numbers in buf, of length buflen, in row-major order. If buf is too short,
+the numbers are truncated as snprintf would.
+*/
+int findparkersquare_str(char *buf, size_t buflen, const primefactor_t *rootmidfac, size_t numfac) {
+    mpz_t square[9];
+    size_t i, start = 0;
+    int found;
+    for (i = 0; i < 9; i++) {
+        mpz_init(square[i]);
+    }
+    found = findparkersquare(square, rootmidfac, numfac);
+    if (buflen > 0) {
+        buf[0] = '\0';
+    }
+    for (i = 0; i < 9 && start < buflen; i++) {
+        start += gmp_snprintf(buf + start, buflen - start, i == 0 ? "%Zd" : " %Zd", square[i]);
+    }
+    for (i = 0; i < 9; i++) {
+        mpz_clear(square[i]);
+    }
+    return found;
+}
@@ -7,6 +7,8 @@
 #include "squares.h"
 
 int findparkersquare(mpz_t *square, const primefactor_t *rootmidfac, size_t numfac);
+size_t findparkersquares(int *fits, const primefactor_t *facs, const size_t *lens, size_t count);
+int findparkersquare_str(char *buf, size_t buflen, const primefactor_t *rootmidfac, size_t numfac);
 
 #ifdef TESTING
 int constructsquare(
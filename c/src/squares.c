@@ -174,8 +174,8 @@ size_t primepowersumsquares(pair_t *out, primefactor_t pf) {
             diophantus(&out[i], &tmp1[i], &tmp2[pf.e - i]);
         }
 
-        pair_array_clear(tmp1, pf.e);
-        pair_array_clear(tmp2, pf.e);
+        pair_array_clear(tmp1, pf.e + 1);
+        pair_array_clear(tmp2, pf.e + 1);
         free(tmp1);
         free(tmp2);
         pair_clear(&base);
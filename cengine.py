@@ -0,0 +1,69 @@
+"""Module giving access to the C implementation of check_middle in c/src,
+built as a shared library with 'make' in that directory. If the library
+has not been built, 'available' is False and the Python implementation in
+parkersquare.py must be used instead. The location of the library can be
+overridden with the environment variable PARKERSQUARE_CLIB."""
+
+import os
+import ctypes
+
+import factors
+
+
+class _PrimeFactor(ctypes.Structure):
+    """Matches primefactor_t in c/src/primes.h"""
+    _fields_ = [("p", ctypes.c_ulong), ("e", ctypes.c_ulong)]
+
+
+LIBPATH = os.environ.get(
+    "PARKERSQUARE_CLIB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "c", "src", "libparkersquare.so"))
+
+try:
+    _lib = ctypes.CDLL(LIBPATH)
+except OSError:
+    _lib = None
+else:
+    _lib.findparkersquares.restype = ctypes.c_size_t
+    _lib.findparkersquares.argtypes = [
+        ctypes.POINTER(ctypes.c_int), ctypes.POINTER(_PrimeFactor),
+        ctypes.POINTER(ctypes.c_size_t), ctypes.c_size_t]
+    _lib.findparkersquare_str.restype = ctypes.c_int
+    _lib.findparkersquare_str.argtypes = [
+        ctypes.c_char_p, ctypes.c_size_t, ctypes.POINTER(_PrimeFactor), ctypes.c_size_t]
+
+available = _lib is not None
+
+
+def _getsquare(fac):
+    """Return the fit and best square the C engine finds for one candidate."""
+    facarray = (_PrimeFactor * len(fac))(*fac.items())
+    # Every entry of the square is less than 3k/2 = 3m^2
+    buflen = 9 * (2 * len(str(factors.getnum(fac))) + 4)
+    buf = ctypes.create_string_buffer(buflen)
+    fit = _lib.findparkersquare_str(buf, buflen, facarray, len(fac))
+    nums = [int(x) for x in buf.value.split()]
+    return fit, [nums[0:3], nums[3:6], nums[6:9]]
+
+
+def check_many(facs):
+    """Check many square rooted middle numbers, given by their prime
+    factorizations, in one call to the C engine. Return a list with the
+    same tuples fac,fit,square that parkersquare.check_middle returns for
+    each one."""
+    if not available:
+        raise RuntimeError(f"C engine not found at {LIBPATH}. Run 'make' in c/src.")
+    facs = list(facs)
+    flat = [pe for fac in facs for pe in fac.items()]
+    facarray = (_PrimeFactor * len(flat))(*flat)
+    lens = (ctypes.c_size_t * len(facs))(*(len(fac) for fac in facs))
+    fits = (ctypes.c_int * len(facs))()
+    _lib.findparkersquares(fits, facarray, lens, len(facs))
+    results = []
+    for fac,fit in zip(facs, fits):
+        if fit > 0:
+            # Rare, so find the square again, this time keeping it
+            results.append((fac, *_getsquare(fac)))
+        else:
+            results.append((fac, 0, None))
+    return results
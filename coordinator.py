@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""Coordinate a search for Parker squares across several machines. One
+coordinator hands out leases on intervals of r22 values over TCP, and any
+number of workers check those intervals with parkersquare.check_range and
+report back. Workers renew their leases while they work, and leases that
+are neither renewed nor completed in time are handed out again. Completing
+an interval twice is harmless, so a slow worker and the worker that took
+over its lease can both finish. The coordinator keeps a ledger of every
+completed interval and every hourglass or square found."""
+
+import os
+import json
+import time
+import socket
+import signal
+import argparse
+import threading
+import socketserver
+import multiprocessing as mp
+
+import factors
+import parkersquare
+
+
+###############################################################################
+
+
+class Ledger:
+    """Record of which intervals have been searched, which are leased out,
+    and what was found. All methods are safe to call from several threads."""
+
+    def __init__(self, start=1, length=10**6, leasetime=600):
+        self.start = start
+        self.length = length
+        self.leasetime = leasetime
+        self.next = start     # Everything from here up has not been leased
+        self.completed = []   # Sorted, disjoint, merged [lo, hi] intervals
+        self.leases = {}      # lo -> (hi, expiry time)
+        self.count = 0
+        self.hits = []
+        self.lock = threading.Lock()
+
+    def _iscompleted(self, lo, hi):
+        return any(a <= lo and hi <= b for a,b in self.completed)
+
+    def _addcompleted(self, lo, hi):
+        """Insert [lo, hi) into the completed intervals, merging neighbors."""
+        merged = []
+        for a,b in self.completed:
+            if b < lo or hi < a:
+                merged.append([a,b])
+            else:
+                lo, hi = min(a,lo), max(b,hi)
+        merged.append([lo,hi])
+        self.completed = sorted(merged)
+
+    def lease(self):
+        """Return a tuple lo,hi of an interval to search. Expired leases are
+        handed out again before new intervals are started."""
+        with self.lock:
+            now = time.time()
+            for lo,(hi,expiry) in sorted(self.leases.items()):
+                if expiry < now:
+                    self.leases[lo] = (hi, now + self.leasetime)
+                    return lo, hi
+            lo, hi = self.next, self.next + self.length
+            self.next = hi
+            self.leases[lo] = (hi, now + self.leasetime)
+            return lo, hi
+
+    def renew(self, lo, hi):
+        """Extend the lease on [lo, hi) by leasetime from now. Return False
+        if there is no such lease, e.g. because it was completed."""
+        with self.lock:
+            if self.leases.get(lo, (None,))[0] != hi:
+                return False
+            self.leases[lo] = (hi, time.time() + self.leasetime)
+            return True
+
+    def complete(self, lo, hi, count, hits):
+        """Record that [lo, hi) was searched, finding count candidates and
+        the given hits. Return False if it was already recorded."""
+        with self.lock:
+            self.leases.pop(lo, None)
+            if self._iscompleted(lo, hi):
+                return False
+            self._addcompleted(lo, hi)
+            self.count += count
+            self.hits.extend(hits)
+            return True
+
+    def contiguous(self):
+        """Return n such that every r22 in [start, n) has been searched."""
+        with self.lock:
+            if self.completed and self.completed[0][0] <= self.start:
+                return self.completed[0][1]
+            return self.start
+
+    def todict(self):
+        with self.lock:
+            return {
+                "start": self.start, "length": self.length,
+                "leasetime": self.leasetime, "next": self.next,
+                "completed": self.completed, "count": self.count,
+                "hits": self.hits,
+            }
+
+    @classmethod
+    def fromdict(cls, state):
+        ledger = cls(state["start"], state["length"], state["leasetime"])
+        ledger.next = state["next"]
+        ledger.completed = state["completed"]
+        ledger.count = state["count"]
+        ledger.hits = state["hits"]
+        # Any gaps below 'next' were leased before a restart. Hand them out
+        # again immediately.
+        gaps = []
+        prev = ledger.start
+        for a,b in ledger.completed + [[ledger.next, ledger.next]]:
+            if prev < a:
+                gaps.append((prev, a))
+            prev = max(prev, b)
+        for lo,hi in gaps:
+            for unit in range(lo, hi, ledger.length):
+                ledger.leases[unit] = (min(unit + ledger.length, hi), 0)
+        return ledger
+
+
+###############################################################################
+
+
+def _encodehit(hit):
+    """Convert a result of check_middle into something JSON can store."""
+    fac, fit, square = hit
+    return {"factors": sorted(fac.items()), "fit": fit, "square": square}
+
+
+# Attempts at each request to the coordinator, and the seconds to wait
+# after the first failure, doubling after each one up to MAX_BACKOFF
+RETRIES = 8
+BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+# Seconds without a reply before a request to the coordinator fails
+TIMEOUT = 60.0
+
+
+def _request(address, message, retries=RETRIES, backoff=BACKOFF):
+    """Send one JSON message to the coordinator and return its reply. If the
+    connection fails or is closed before the reply, try again up to retries
+    times in all, waiting backoff seconds and doubling that each time. Every
+    message can be repeated safely: a lease whose reply was lost is handed
+    out again when it expires, and renewing or completing twice is
+    harmless."""
+    for attempt in range(retries):
+        try:
+            with socket.create_connection(address, timeout=TIMEOUT) as sock:
+                sock.sendall((json.dumps(message) + "\n").encode())
+                with sock.makefile("r") as f:
+                    line = f.readline()
+            if not line:
+                raise ConnectionError("Connection closed before the reply")
+            return json.loads(line)
+        except OSError as e:
+            if attempt + 1 == retries:
+                raise
+            print(f"{message['op']} failed ({e}), retrying in {backoff:g}s", flush=True)
+            time.sleep(backoff)
+            backoff = min(2 * backoff, MAX_BACKOFF)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Answer one JSON message per line from a worker."""
+
+    def handle(self):
+        server = self.server
+        for line in self.rfile:
+            message = json.loads(line)
+            if message["op"] == "lease":
+                lo, hi = server.ledger.lease()
+                reply = {"lo": lo, "hi": hi, "leasetime": server.ledger.leasetime}
+            elif message["op"] == "renew":
+                reply = {"renewed": server.ledger.renew(message["lo"], message["hi"])}
+            elif message["op"] == "complete":
+                new = server.ledger.complete(
+                    message["lo"], message["hi"], message["count"], message["hits"])
+                if new:
+                    server.saveledger()
+                    for hit in message["hits"]:
+                        print(f"{message['worker']}: {hit}", flush=True)
+                reply = {"new": new}
+            elif message["op"] == "status":
+                reply = {"contiguous": server.ledger.contiguous(), **server.ledger.todict()}
+            else:
+                reply = {"error": f"Unknown operation {message['op']}"}
+            self.wfile.write((json.dumps(reply) + "\n").encode())
+
+
+class CoordinatorServer(socketserver.ThreadingTCPServer):
+    """TCP server handing out leases from a Ledger, saved to statefile after
+    every newly completed interval."""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, ledger, statefile=None):
+        super().__init__(address, _Handler)
+        self.ledger = ledger
+        self.statefile = statefile
+        self.savelock = threading.Lock()
+
+    def saveledger(self):
+        if self.statefile is not None:
+            with self.savelock:
+                parkersquare.save_checkpoint(self.statefile, self.ledger.todict())
+
+
+def serve(host, port, statefile=None, start=1, length=10**6, leasetime=600):
+    """Run the coordinator until interrupted, resuming from statefile if it
+    exists."""
+    if (statefile is not None) and os.path.exists(statefile):
+        ledger = Ledger.fromdict(parkersquare.load_checkpoint(statefile))
+        print(f"Resuming with all below {ledger.contiguous()} searched", flush=True)
+    else:
+        ledger = Ledger(start, length, leasetime)
+    # Treat SIGTERM like Ctrl-C so the ledger is saved on the way out
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    with CoordinatorServer((host, port), ledger, statefile) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.saveledger()
+
+
+def work(host, port, procs=None, name=None, maxunits=None, primetable=None):
+    """Repeatedly lease an interval from the coordinator, check it with a pool
+    of procs processes, and report the results. The lease is renewed every
+    third of its leasetime until the interval is checked, so a long
+    interval is not handed out again while it is still being worked on.
+    Stops after maxunits intervals, or never if maxunits is None. The
+    processes share the prime table at primetable, if given (see
+    primetable.py)."""
+    address = (host, port)
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    procs = procs or os.cpu_count()
+    done = 0
+    with mp.Pool(procs, initializer=factors.use_primetable, initargs=(primetable,)) as pool:
+        while (maxunits is None) or (done < maxunits):
+            lease = _request(address, {"op": "lease", "worker": name})
+            lo, hi = lease["lo"], lease["hi"]
+            # Split the lease evenly among the processes
+            bounds = [lo + (hi - lo) * i // procs for i in range(procs + 1)]
+            pending = pool.starmap_async(parkersquare.check_range, zip(bounds, bounds[1:]))
+            while not pending.ready():
+                pending.wait(lease["leasetime"] / 3)
+                if not pending.ready():
+                    _request(address, {"op": "renew", "worker": name, "lo": lo, "hi": hi})
+            results = pending.get()
+            count = sum(r[2] for r in results)
+            hits = [_encodehit(hit) for r in results for hit in r[3]]
+            _request(address, {"op": "complete", "worker": name, "lo": lo,
+                               "hi": hi, "count": count, "hits": hits})
+            done += 1
+            datestr = time.strftime("%Y-%m-%d %H:%M:%S")
+            print(f"{datestr} {name}: [{lo}, {hi}) {count} candidates", flush=True)
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Coordinate a search for Parker squares across machines.")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="coordinator address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=5715,
+                        help="coordinator port (default: 5715)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serveparser = sub.add_parser("serve", help="run the coordinator")
+    serveparser.add_argument("--state", default=None,
+                             help="file in which to keep the ledger")
+    serveparser.add_argument("--start", type=int, default=1,
+                             help="first r22 to search (default: 1)")
+    serveparser.add_argument("--length", type=int, default=10**6,
+                             help="r22 values per lease (default: 1000000)")
+    serveparser.add_argument("--leasetime", type=float, default=600,
+                             help="seconds before a lease is reissued (default: 600)")
+    workparser = sub.add_parser("work", help="run a worker")
+    workparser.add_argument("--procs", type=int, default=None,
+                            help="number of worker processes (default: all CPUs)")
+    workparser.add_argument("--name", default=None,
+                            help="name reported to the coordinator")
+    workparser.add_argument("--primes", default=None,
+                            help="prime table built by primetable.py to share between workers")
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args.host, args.port, args.state, args.start, args.length, args.leasetime)
+    else:
+        work(args.host, args.port, args.procs, args.name, primetable=args.primes)
@@ -1,21 +1,29 @@
 #!/usr/bin/env python3
 
-import math
-import itertools
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import residues
 
 checkmod = 144
 #checkmod = 5184
 
 # Calculate the possible residuals for squares and sums of squares in the given mod
-squareresids = {(i ** 2) % checkmod for i in range(checkmod)}
-sumsquareresids = {(i + j) % checkmod for i,j in itertools.combinations_with_replacement(squareresids, 2)}
+squares = residues.squares(checkmod)
+sumsquares = residues.sumsquares(checkmod, squares)
+squareresids = set(np.flatnonzero(squares).tolist())
+sumsquareresids = set(np.flatnonzero(sumsquares).tolist())
 # For each sum of squares residual, find all square residuals that could contribute to it
+r = np.arange(checkmod)
 candidatesquareresids = {
-    x:{i for i in squareresids if (x - i) % checkmod in squareresids} 
+    x:set(np.flatnonzero(squares & squares[(x - r) % checkmod]).tolist())
     for x in sumsquareresids
 }
 candidateresids = {
-    x:{i for i in range(checkmod) if (i**2) % checkmod in candidatesquareresids[x]}
+    x:set(np.flatnonzero(np.isin(r * r % checkmod, list(candidatesquareresids[x]))).tolist())
     for x in sumsquareresids
 }
 
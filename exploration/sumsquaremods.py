@@ -1,24 +1,19 @@
 #!/usr/bin/env python3
 
-import itertools
+# Find the moduli with the smallest fraction of residues that are a sum of
+# two squares. This used to build the sets of sums with
+# itertools.combinations_with_replacement for every modulus, which made
+# anything past 2^16 impractical; residues.py scans them with a process pool.
 
-#mods = range(2, 2 ** 16 + 1)
-
-maxmod = 2**16
-
-bestratio = 1.0
-bestmod = 1
-
-for mod in range(2, maxmod + 1):
-    squareresids = {(i ** 2) % mod for i in range(mod)}
-    ratio_lb = len(squareresids) / mod
-    if ratio_lb < bestratio: # Only continue if there's a chance
-        sumsquareresids = {(i + j) % mod for i,j in itertools.combinations_with_replacement(squareresids, 2)}
-        ratio = len(sumsquareresids) / mod
-        if ratio < bestratio:
-            bestratio = ratio
-            bestmod = mod
-            print(f"{bestmod}: {bestratio}")
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import residues
 
+maxmod = 2**20
 
+if __name__ == '__main__':
+    moduli, squareratio, sumratio = residues.scan(2, maxmod + 1)
+    for mod,ratio in zip(*residues.records(moduli, sumratio)):
+        print(f"{mod}: {ratio}")
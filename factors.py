@@ -2,10 +2,17 @@
 sums of squares from factorizations."""
 
 import math
+import random
+import bisect
 import itertools
 import functools
 import operator
 
+import numpy as np
+
+import backend
+import metrics
+
 
 class FactorException(Exception):
     pass
@@ -20,27 +27,279 @@ def _countup():
         n += 2
 
 
-def isprime(n):
-    """Return True if n is prime, False otherwise."""
-    for p in _countup():
-        if p * p > n:
-            return True
-        elif n % p == 0:
+# Size of each block of integers sieved at once by the segmented sieve. This
+# bounds the memory used when streaming primes.
+SEGMENT_SIZE = 2 ** 18
+
+# Most entries kept in each of the caches of sums of squares of primes and
+# prime powers, so that long searches do not grow without limit
+PRIME_CACHE_SIZE = 2 ** 18
+POWER_CACHE_SIZE = 2 ** 14
+
+# Table of primes p == 1 (mod 4) with their sums of two squares a^2 + b^2,
+# memory-mapped read-only from a file written by primetable.py so that every
+# process shares one copy. See use_primetable.
+PRIMETABLE_DTYPE = np.dtype([("p", "<u8"), ("a", "<u4"), ("b", "<u4")])
+_primetable = None
+_primetablelimit = 0
+
+# Primes found so far by _primesupto, used as sieving primes and for trial
+# division. Grows on demand.
+_primecache = [2, 3, 5, 7]
+_primecachelimit = 10
+
+
+def _simplesieve(n):
+    """Return a list of all primes strictly less than n using a plain
+    (unsegmented) Sieve of Eratosthenes."""
+    if n < 3:
+        return []
+    sieve = bytearray([1]) * n
+    sieve[0] = sieve[1] = 0
+    for p in range(2, math.isqrt(n - 1) + 1):
+        if sieve[p]:
+            sieve[p*p::p] = bytes(len(range(p*p, n, p)))
+    return list(itertools.compress(range(n), sieve))
+
+
+def _primesupto(n):
+    """Return a list, in increasing order, containing at least all primes
+    less than or equal to n. The list is shared and must not be modified."""
+    global _primecache, _primecachelimit
+    if n >= _primecachelimit:
+        limit = max(n + 1, 2 * _primecachelimit)
+        cache = _simplesieve(limit)
+        # The cache is replaced before the limit is raised, so that other
+        # threads never see a limit the cache doesn't reach
+        _primecache = cache
+        _primecachelimit = limit
+        return cache
+    return _primecache
+
+
+def _segments(lo, hi=None):
+    """Generator of segments of the Sieve of Eratosthenes covering the
+    integers in [lo, hi), or [lo, infinity) if hi is None. Yields tuples
+    (start, sieve) where sieve is a bytearray and sieve[i] is nonzero exactly
+    when start + i is prime. Each segment is at most SEGMENT_SIZE long."""
+    start = max(lo, 0)
+    while (hi is None) or (start < hi):
+        end = start + SEGMENT_SIZE
+        if hi is not None:
+            end = min(end, hi)
+        sieve = bytearray([1]) * (end - start)
+        # 0 and 1 are not prime
+        for n in range(start, min(end, 2)):
+            sieve[n - start] = 0
+        # Cross off multiples of each sieving prime, starting at p^2
+        root = math.isqrt(end - 1)
+        for p in _primesupto(root):
+            if p > root:
+                break
+            first = max(p * p, -(-start // p) * p)
+            if first < end:
+                sieve[first-start::p] = bytes(len(range(first, end, p)))
+        yield start, sieve
+        start = end
+
+
+# Above this, factorize and factorize1mod4 divide out small primes and then
+# split what is left with Pollard's rho instead of trial division, and
+# isprime uses the Miller-Rabin test
+LARGE = 2 ** 32
+
+# Trial division by primes below this before Pollard's rho
+TRIAL_LIMIT = 2 ** 10
+
+# Miller-Rabin with these bases is correct for every n < 3.3 * 10^24, which
+# includes all 64 bit integers. Larger n are also tested with random bases.
+_MR_BASES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41]
+_MR_LIMIT = 3317044064679887385961981
+_MR_ROUNDS = 16
+
+
+def _millerrabin(n, bases):
+    """Return False if any of the bases shows the odd number n > 2 to be
+    composite, True otherwise."""
+    d = n - 1
+    s = 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    for a in bases:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
             return False
+    return True
 
 
-def primes():
-    """Generator of all primes."""
-    for n in _countup():
+def isprime(n):
+    """Return True if n is prime, False otherwise. Exact for n below about
+    3.3 * 10^24, and wrong with probability below 4^-16 above that."""
+    if n < 2:
+        return False
+    if n < _primecachelimit:
+        i = bisect.bisect_left(_primecache, n)
+        return (i < len(_primecache)) and (_primecache[i] == n)
+    if n < LARGE:
+        for p in _primesupto(math.isqrt(n)):
+            if p * p > n:
+                return True
+            elif n % p == 0:
+                return False
+        return True
+    if any(n % p == 0 for p in _MR_BASES):
+        return False
+    if not _millerrabin(n, _MR_BASES):
+        return False
+    if n < _MR_LIMIT:
+        return True
+    rng = random.Random(n)
+    return _millerrabin(n, [rng.randrange(2, n - 1) for _ in range(_MR_ROUNDS)])
+
+
+def _pollardbrent(n):
+    """Return a nontrivial factor of the odd composite n, using Brent's
+    variant of Pollard's rho algorithm."""
+    rng = random.Random(n)
+    n = backend.mpz(n)
+    while True:
+        c = backend.mpz(rng.randrange(1, n))
+        y = backend.mpz(rng.randrange(0, n))
+        m = 128
+        g = r = q = 1
+        while g == 1:
+            x = y
+            for _ in range(r):
+                y = (y * y + c) % n
+            k = 0
+            while (k < r) and (g == 1):
+                ys = y
+                # The sign of x - y doesn't change the gcd, so it is left
+                for _ in range(min(m, r - k)):
+                    y = (y * y + c) % n
+                    q = q * (x - y) % n
+                g = math.gcd(q, n)
+                k += m
+            r *= 2
+        if g == n:
+            # Went past the factor in a batch; step one at a time
+            g = 1
+            while g == 1:
+                ys = (ys * ys + c) % n
+                g = math.gcd(abs(x - ys), n)
+        if g != n:
+            return int(g)
+        # Unlucky choice of c, try another
+
+
+def _factorlarge(n, factors, reject=None):
+    """Add the prime factorization of n to the dictionary factors, dividing
+    out primes below TRIAL_LIMIT and then splitting with Pollard's rho.
+    If reject is a function of a prime and it returns True for any prime
+    factor, stop and return False. Otherwise return True."""
+    for p in _primesupto(TRIAL_LIMIT):
+        if p >= TRIAL_LIMIT or p * p > n:
+            break
+        if n % p == 0:
+            if (reject is not None) and reject(p):
+                return False
+            while n % p == 0:
+                factors[p] = factors.get(p, 0) + 1
+                n //= p
+    # Entries are (m, e) for a factor m^e still to be split
+    stack = [(n, 1)] if n > 1 else []
+    while stack:
+        n, e = stack.pop()
         if isprime(n):
-            yield n
+            if (reject is not None) and reject(n):
+                return False
+            factors[n] = factors.get(n, 0) + e
+        elif backend.is_square(n):
+            # Perfect powers are common here and rho splits them slowly, so
+            # the root is split once for both copies
+            stack.append((int(backend.isqrt(n)), 2 * e))
+        else:
+            d = _pollardbrent(n)
+            stack += [(d, e), (n // d, e)]
+    return True
+
+
+def primes(lo=2, hi=None):
+    """Generator of all primes in [lo, hi), or all primes at least lo if hi
+    is None. Primes are found with a segmented sieve, so memory use is
+    bounded no matter how many are produced."""
+    for start, sieve in _segments(lo, hi):
+        yield from itertools.compress(range(start, start + len(sieve)), sieve)
+
+
+def use_primetable(path):
+    """Memory-map the table of primes 1 mod 4 and their sums of two squares
+    at path, written by primetable.py, and use it in primes1mod4 and to find
+    sums of two squares of primes below its limit. Processes forked after
+    this share the mapping. Pass None to stop using a table."""
+    global _primetable, _primetablelimit
+    if path is None:
+        _primetable, _primetablelimit = None, 0
+        return
+    table = np.load(path, mmap_mode="r")
+    if (table.dtype != PRIMETABLE_DTYPE) or (len(table) == 0):
+        raise FactorException(f"{path} is not a prime table.")
+    # The last row is (limit, 0, 0), recording how far the table is complete
+    _primetable = table[:-1]
+    _primetablelimit = int(table[-1]["p"])
+
+
+def _tablesumsquares(p):
+    """Return the pair (a,b) for the prime p from the prime table, or None if
+    p is not covered by it."""
+    if p >= _primetablelimit:
+        return None
+    ps = _primetable["p"]
+    i = int(np.searchsorted(ps, p))
+    if (i < len(ps)) and (ps[i] == p):
+        return (int(_primetable["a"][i]), int(_primetable["b"][i]))
+    return None
+
+
+def primes1mod4(lo=2, hi=None):
+    """Generator of all primes p == 1 (mod 4) in [lo, hi), or all such primes
+    at least lo if hi is None. Only every fourth entry of each sieve segment
+    is examined. Primes below the limit of the prime table, if one is in
+    use, are read from it instead."""
+    if lo < _primetablelimit:
+        ps = _primetable["p"]
+        end = _primetablelimit if hi is None else min(hi, _primetablelimit)
+        first, last = np.searchsorted(ps, [lo, end])
+        for block in range(first, last, SEGMENT_SIZE):
+            yield from ps[block:min(block + SEGMENT_SIZE, last)].tolist()
+        lo = end
+        if (hi is not None) and (lo >= hi):
+            return
+    for start, sieve in _segments(lo, hi):
+        offset = (1 - start) % 4
+        yield from itertools.compress(
+            range(start + offset, start + len(sieve), 4), sieve[offset::4])
 
 
 def factorize1mod4(n):
     """Check if the prime factorization of a number n contains only odd primes
     congruent to 1 mod 4. If yes, return the prime factorization of n in the
     form of a dictionary {p:e} where p is each prime factor and e is the
-    exponent it is raised to in the prime factorization. If no, return None"""
+    exponent it is raised to in the prime factorization. If no, return None.
+    Above LARGE, uses Pollard's rho instead of trial division, which is as
+    slow as in factorize for balanced products of large primes."""
+    if n >= LARGE:
+        factors = {}
+        if not _factorlarge(n, factors, reject=lambda p: p % 4 != 1):
+            return None
+        return dict(sorted(factors.items()))
     factors = {}
     tocheck = _countup()
     i = next(tocheck)
@@ -64,7 +323,14 @@ def factorize1mod4(n):
 def factorize(n):
     """Return the prime factorization of n in the form of a dictionary of
     entries {p:e}, where p is a prime factor and e is the exponent it is
-    raised to in the prime factorization."""
+    raised to in the prime factorization. Above LARGE, uses Pollard's rho
+    instead of trial division. Rho takes time about the square root of the
+    second largest prime factor, so balanced products of two primes above
+    about 25 digits in all take seconds, and longer ones much longer."""
+    if n >= LARGE:
+        factors = {}
+        _factorlarge(n, factors)
+        return dict(sorted(factors.items()))
     factors = {}
     tocheck = _countup()
     i = next(tocheck)
@@ -79,6 +345,112 @@ def factorize(n):
     return factors
 
 
+def _sievesegment(start, end, only_1mod4):
+    """Sieve the integers in [start, end) by every prime up to sqrt(end).
+    Returns a tuple (entries, bad, prod, rem). entries is a list of arrays
+    (idx, p, e) meaning start + idx has p to the power e in its
+    factorization, bad marks the integers with a prime factor not congruent
+    to 1 mod 4, prod is the product of 2e + 1 over the sieving primes
+    congruent to 1 mod 4, and rem is what remains after dividing out the
+    sieving primes: 1 or a single larger prime. If only_1mod4, no entries
+    are produced for other primes."""
+    rem = np.arange(start, end, dtype=np.int64)
+    bad = np.zeros(end - start, dtype=bool)
+    prod = np.ones(end - start, dtype=np.int64)
+    entries = []
+    root = math.isqrt(end - 1)
+    for p in _primesupto(root):
+        if p > root:
+            break
+        first = -(-start // p) * p
+        idx = np.arange(first - start, end - start, p)
+        if idx.size == 0:
+            continue
+        if p % 4 != 1:
+            bad[idx] = True
+            if only_1mod4:
+                continue
+        # Count the exponent of p by sieving with each of its powers in turn
+        exps = np.ones(idx.size, dtype=np.int64)
+        q = p * p
+        while q < end:
+            firstq = -(-start // q) * q
+            exps[(firstq - first) // p::q // p] += 1
+            q *= p
+        rem[idx] //= np.power(p, exps)
+        prod[idx] *= 2 * exps + 1
+        entries.append((idx, np.full(idx.size, p, dtype=np.int64), exps))
+    # Whatever remains above 1 is a single prime larger than sqrt(end)
+    big = rem > 1
+    bad |= big & (rem % 4 != 1)
+    prod[big] *= 3
+    return entries, bad, prod, rem
+
+
+def _factorsegment(start, end, only_1mod4, minways=0):
+    """Factorize every integer in [start, end) together. Returns a list of
+    tuples (n, factors) as described in factorize_range."""
+    entries, bad, prod, rem = _sievesegment(start, end, only_1mod4)
+    idx = np.flatnonzero(rem > 1)
+    entries.append((idx, rem[idx], np.ones(idx.size, dtype=np.int64)))
+    # Only build dictionaries for the integers that are kept
+    if only_1mod4:
+        keep = ~bad & (prod >= 2 * minways + 1)
+        stats = metrics.active()
+        if stats is not None:
+            # 2n^2 has (prod - 1) / 2 pairs, counted before dropping those
+            # with fewer than minways
+            ways, counts = np.unique((prod[~bad] - 1) // 2, return_counts=True)
+            stats.numways.update(dict(zip(ways.tolist(), counts.tolist())))
+    else:
+        keep = np.ones(end - start, dtype=bool)
+    # Entries were produced in increasing order of prime, so each dictionary
+    # is built in increasing order of prime too.
+    idx, ps, es = (np.concatenate(col) for col in zip(*entries))
+    if only_1mod4:
+        sel = keep[idx]
+        idx, ps, es = idx[sel], ps[sel], es[sel]
+    facs = [{} for _ in range(end - start)]
+    for i,p,e in zip(idx.tolist(), ps.tolist(), es.tolist()):
+        facs[i][p] = e
+    return [(start + i, facs[i]) for i in np.flatnonzero(keep).tolist()]
+
+
+def factorize_range(lo, hi, only_1mod4=False, minways=0):
+    """Generator of (n, factors) for every integer n in [lo, hi), in
+    increasing order, where factors is the prime factorization of n as
+    returned by factorize(). The range is sieved in segments of SEGMENT_SIZE
+    integers with NumPy arrays, so this is much faster than calling factorize
+    in a loop. If only_1mod4 is True, integers with any prime factor not
+    congruent to 1 mod 4 are skipped, as factorize1mod4 would reject them,
+    and so are integers n for which 2n^2 has fewer than minways pairs of
+    squares surrounding n^2 (see numways_range). Requires 1 <= lo and
+    hi < 2^63."""
+    if lo < 1:
+        raise FactorException("Can only factorize positive integers.")
+    for start in range(lo, hi, SEGMENT_SIZE):
+        end = min(start + SEGMENT_SIZE, hi)
+        yield from _factorsegment(start, end, only_1mod4, minways)
+
+
+def numways_range(lo, hi):
+    """Return a NumPy array whose entry i is the number of pairs of squares
+    surrounding n^2 that sum to 2n^2, where n = lo + i, for every n in
+    [lo, hi). By Jacobi's two-square theorem this is (prod(2e+1) - 1) / 2
+    over the prime powers p^e of n. Entries are 0 for n that are even or
+    have any prime factor congruent to 3 mod 4, which are never the middle
+    of a parker square. Computed by sieving alone, without building any
+    factorizations. Requires 1 <= lo and hi < 2^63."""
+    if lo < 1:
+        raise FactorException("Can only factorize positive integers.")
+    segments = []
+    for start in range(lo, hi, SEGMENT_SIZE):
+        end = min(start + SEGMENT_SIZE, hi)
+        _, bad, prod, _ = _sievesegment(start, end, True)
+        segments.append(np.where(bad, 0, (prod - 1) // 2))
+    return np.concatenate(segments) if segments else np.zeros(0, dtype=np.int64)
+
+
 def countsumsquares(factors):
     """Given the prime factorization of a number, return the number of
     ways in which it can be expressed as the sum of two squares. This is
@@ -104,11 +476,51 @@ def _diophantus(pair1, pair2):
     return (a*p-b*q),(a*q+b*p)
 
 
-@functools.lru_cache(maxsize = None)
+def _sqrtminusone(p):
+    """Given a prime p == 1 (mod 4), return an x with x^2 == -1 (mod p).
+    Found by raising a quadratic non-residue c to the power (p-1)/4."""
+    # 2 is a non-residue for every p == 5 (mod 8). Otherwise search the
+    # small primes, one of which is a non-residue.
+    if p % 8 == 5:
+        c = 2
+    else:
+        for c in itertools.islice(_primesupto(1000), 1, None):
+            if pow(c, (p - 1) // 2, p) == p - 1:
+                break
+    return pow(c, (p - 1) // 4, p)
+
+
+@functools.lru_cache(maxsize = PRIME_CACHE_SIZE)
 def _primesumsquares(p):
+    """Given a prime p == 1 (mod 4), find the pair of integers (a,b), with
+    0 < a < b, such that a^2 + b^2 == p. Uses Cornacchia's algorithm (the
+    Hermite-Serret reduction): run the Euclidean algorithm on p and a square
+    root of -1 mod p until the remainder drops below sqrt(p). Will return
+    exactly one pair."""
+    # Base cases:
+    if p < 2:
+        raise FactorException("Got non-prime.")
+    elif p == 2:
+        return (1,1)
+    elif p % 4 == 3:
+        return None
+    # Euclidean reduction
+    limit = math.isqrt(p)
+    r0, r1 = p, _sqrtminusone(p)
+    while r1 > limit:
+        r0, r1 = r1, r0 % r1
+    a = r1
+    b = math.isqrt(p - a * a)
+    if a * a + b * b != p:
+        raise FactorException(f"Algorithm did not find pair (a,b) for {p}")
+    return (min(a,b), max(a,b))
+
+
+def _primesumsquares_walk(p):
     """Given a prime p == 1 (mod 4), exhaustively look for a pair of
     integers (a,b), with 0 < a < b, such that a^2 + b^2 == p. Will
-    return exactly one pair."""
+    return exactly one pair. This takes O(sqrt(p)) time and is kept as a
+    cross-check for _primesumsquares."""
     # Base cases:
     if p < 2:
         raise FactorException("Got non-prime.")
@@ -135,7 +547,22 @@ def _primesumsquares(p):
     raise FactorException(f"Algorithm did not find pair (a,b) for {p}")
 
 
-@functools.lru_cache(maxsize = None)
+def primesumsquares_range(lo, hi):
+    """Generator of (p,(a,b)) for every prime p == 1 (mod 4) in [lo, hi),
+    where 0 < a < b and a^2 + b^2 == p. Each result not read from the prime
+    table is also stored in the cache used by _primesumsquares."""
+    if lo < _primetablelimit:
+        end = _primetablelimit if hi is None else min(hi, _primetablelimit)
+        first, last = np.searchsorted(_primetable["p"], [lo, end])
+        for block in range(first, last, SEGMENT_SIZE):
+            rows = _primetable[block:min(block + SEGMENT_SIZE, last)]
+            yield from zip(rows["p"].tolist(), zip(rows["a"].tolist(), rows["b"].tolist()))
+        lo = end
+    for p in primes1mod4(lo, hi):
+        yield p, _primesumsquares(p)
+
+
+@functools.lru_cache(maxsize = POWER_CACHE_SIZE)
 def _primepowersumsquares(p, e):
     """Find the ways the nubmer p^e can be written as the sum
     of two squares, where p is a prime and e >= 1. Does not check
@@ -152,8 +579,9 @@ def _primepowersumsquares(p, e):
         return [(2 ** (e // 2), 2 ** (e // 2))]
     elif (p == 2) and (e % 2 == 0):
         return [(2 ** (e // 2), 0)]
-    # Find the base pair for the prime
-    a,b = _primesumsquares(p)
+    # Find the base pair for the prime, in the big integer backend's type so
+    # that all products built from it are too
+    a,b = map(backend.mpz, _tablesumsquares(p) or _primesumsquares(p))
     # Create lists of powers of that pair
     powers = [(1,0)] + [None] * e
     reversepowers = [(1,0)] + [None] * e
@@ -201,6 +629,77 @@ def getsumsquares(factors):
     return pairs
 
 
+
+def _canonicalstep(pairs, p, e):
+    """Multiply a running list of (pair, tied) from getcanonicalsumsquares
+    by the pairs for p^e, where p == 1 (mod 4). tied is whether all choices
+    so far were self-conjugate."""
+    fpairs = _primepowersumsquares(p,e)
+    newpairs = []
+    for x,tied in pairs:
+        if tied:
+            newpairs.extend((_diophantus(x, fpairs[j]), 2*j == e) for j in range(e//2 + 1))
+        else:
+            newpairs.extend((_diophantus(x, y), False) for y in fpairs)
+    return newpairs
+
+
+def _canonicalfinish(pairs, scale, oddtwo):
+    """Multiply a running list of (pair, tied) from getcanonicalsumsquares by
+    1+i if oddtwo, scale, and rotate into the first octant."""
+    result = []
+    for (a,b),_ in pairs:
+        if oddtwo:
+            a,b = a - b, a + b
+        a,b = abs(a) * scale, abs(b) * scale
+        result.append((min(a,b), max(a,b)))
+    return result
+
+
+def getcanonicalsumsquares(factors):
+    """Given the prime factorization of a positive integer n, return each pair
+    of integers (a,b) with 0 <= a <= b such that a^2 + b^2 = n exactly once.
+
+    Treating pairs as Gaussian integers a + bi, these are the ways to write n
+    as a norm up to multiplication by units and conjugation. Conjugation
+    turns the choice p^e = pi^j * conj(pi)^(e-j) into j -> e-j for every
+    prime at once, so only choices that are lexicographically no greater
+    than their conjugate are built. An odd power of 2 is applied last as
+    multiplication by 1+i, so the pairs for 2m^2 come from those of m^2."""
+    scale = 1
+    oddtwo = False
+    # Running list of (pair, whether all choices so far were self-conjugate)
+    pairs = [((1,0), True)]
+    for p,e in factors.items():
+        if p == 2:
+            scale *= 2 ** (e // 2)
+            oddtwo = (e % 2 == 1)
+        elif (p % 4 == 3) and (e % 2 == 1):
+            pairs = []
+            break
+        elif (p % 4 == 3) and (e % 2 == 0):
+            scale *= p ** (e // 2)
+        else:
+            pairs = _canonicalstep(pairs, p, e)
+    result = _canonicalfinish(pairs, scale, oddtwo)
+    # Compare the number produced to the expected number (Jacobi). Pairs with
+    # a == 0 (n square) or a == b (n twice a square) are counted 4 times by
+    # Jacobi's theorem, all others 8 times.
+    squarelike = all(e % 2 == 0 for p,e in factors.items() if p != 2)
+    if len(result) != (countsumsquares(factors) + 4 * squarelike) // 8:
+        raise FactorException("Failed to produce all pairs.")
+    return result
+
+def cachestats():
+    """Return the hits, misses, current size and maximum size of the caches
+    of sums of squares of primes and prime powers, as a dictionary of
+    dictionaries keyed by cache name."""
+    return {
+        "primesumsquares": _primesumsquares.cache_info()._asdict(),
+        "primepowersumsquares": _primepowersumsquares.cache_info()._asdict(),
+    }
+
+
 def getnum(factors):
     """Recompute the original number represented by this prime factorization."""
     if len(factors) == 0:
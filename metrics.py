@@ -0,0 +1,194 @@
+"""Module containing optional counters and timers for the stages of checking
+candidates, and for reporting them while a search runs. Nothing is recorded
+unless enable() has been called in the thread doing the work."""
+
+import os
+import json
+import time
+import resource
+import threading
+import collections
+import http.server
+
+
+class Metrics:
+    """Running totals of named counters, named timers (in seconds), and a
+    histogram of the number of border pairs (numways) of the numbers with
+    only primes 1 mod 4 in each range sieved by factors.factorize_range,
+    counted before those with too few pairs are dropped. Engines that do
+    not sieve for candidates leave the histogram empty."""
+
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.timers = collections.Counter()
+        self.numways = collections.Counter()
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def time(self, name, seconds):
+        self.timers[name] += seconds
+
+    def todict(self):
+        return {
+            "counters": dict(self.counters),
+            "timers": dict(self.timers),
+            "numways": dict(self.numways),
+        }
+
+    def merge(self, record):
+        """Add in the totals from a dictionary produced by todict()."""
+        self.counters.update(record["counters"])
+        self.timers.update(record["timers"])
+        # Keys become strings when passed through JSON
+        self.numways.update({int(k):v for k,v in record["numways"].items()})
+
+
+# Metrics being recorded in this process, or None if disabled
+# Each thread records separately, so that the workers of a thread pool
+# don't share totals
+_local = threading.local()
+
+
+def enable():
+    """Start recording metrics in this thread."""
+    _local.active = Metrics()
+
+
+def disable():
+    """Stop recording metrics in this thread."""
+    _local.active = None
+
+
+def active():
+    """Return the Metrics being recorded in this thread, or None."""
+    return getattr(_local, "active", None)
+
+
+def collect():
+    """Return everything recorded in this thread since the last call, as a
+    dictionary, and start again from zero. Also includes the id of this
+    worker and the memory use of its process. The id is the process id, with
+    the thread id appended outside the main thread. Returns None if metrics
+    are not enabled."""
+    if active() is None:
+        return None
+    record = _local.active.todict()
+    if threading.current_thread() is threading.main_thread():
+        record["pid"] = os.getpid()
+    else:
+        record["pid"] = f"{os.getpid()}.{threading.get_native_id()}"
+    record["rss"] = rss()
+    _local.active = Metrics()
+    return record
+
+
+def rss():
+    """Return the resident memory of this process in bytes. Falls back to
+    the peak resident memory where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+###############################################################################
+
+
+class Reporter:
+    """Aggregates metrics records sent back from pool workers. Periodically
+    appends a JSON record to a file, and optionally serves the totals in
+    the Prometheus text format at http://localhost:port/metrics."""
+
+    def __init__(self, path=None, port=None, interval=60):
+        self.path = path
+        self.interval = interval
+        self.totals = Metrics()
+        self.workers = {}  # pid -> {"candidates": n, "seconds": t, "rss": b}
+        self.begin = self.lastwrite = time.monotonic()
+        self.lastcandidates = 0
+        self.lock = threading.Lock()
+        self.server = None
+        if port is not None:
+            reporter = self
+            class Handler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = reporter.prometheus().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                def log_message(self, *args):
+                    pass
+            self.server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def add(self, record, candidates, seconds):
+        """Add one worker's record from collect(), for a task that checked
+        the given number of candidates in the given time."""
+        with self.lock:
+            self.totals.merge(record)
+            self.totals.count("candidates", candidates)
+            worker = self.workers.setdefault(record["pid"], {"candidates": 0, "seconds": 0.0})
+            worker["candidates"] += candidates
+            worker["seconds"] += seconds
+            worker["rss"] = record["rss"]
+
+    def snapshot(self):
+        """Return the current totals and rates as a dictionary."""
+        with self.lock:
+            now = time.monotonic()
+            candidates = self.totals.counters["candidates"]
+            return {
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "elapsed": now - self.begin,
+                "rate": candidates / max(now - self.begin, 1e-9),
+                "recentrate": (candidates - self.lastcandidates) / max(now - self.lastwrite, 1e-9),
+                "rss": rss(),
+                **self.totals.todict(),
+                "workers": {
+                    pid: {"rate": w["candidates"] / max(w["seconds"], 1e-9), **w}
+                    for pid,w in self.workers.items()
+                },
+            }
+
+    def maybewrite(self, extra=None):
+        """Append a record to the file if interval seconds have passed."""
+        if time.monotonic() - self.lastwrite < self.interval:
+            return
+        record = self.snapshot()
+        record.update(extra or {})
+        if self.path is not None:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        with self.lock:
+            self.lastwrite = time.monotonic()
+            self.lastcandidates = self.totals.counters["candidates"]
+
+    def prometheus(self):
+        """Return the current totals in the Prometheus text format."""
+        snap = self.snapshot()
+        lines = [
+            "# TYPE parkersquare_candidates_per_second gauge",
+            f"parkersquare_candidates_per_second {snap['rate']}",
+            "# TYPE parkersquare_rss_bytes gauge",
+            f"parkersquare_rss_bytes {snap['rss']}",
+            "# TYPE parkersquare_events_total counter",
+        ]
+        lines += [f'parkersquare_events_total{{event="{k}"}} {v}' for k,v in sorted(snap["counters"].items())]
+        lines.append("# TYPE parkersquare_stage_seconds_total counter")
+        lines += [f'parkersquare_stage_seconds_total{{stage="{k}"}} {v}' for k,v in sorted(snap["timers"].items())]
+        lines.append("# TYPE parkersquare_numways_total counter")
+        lines += [f'parkersquare_numways_total{{numways="{k}"}} {v}' for k,v in sorted(snap["numways"].items())]
+        lines.append("# TYPE parkersquare_worker_candidates_per_second gauge")
+        lines += [f'parkersquare_worker_candidates_per_second{{pid="{pid}"}} {w["rate"]}' for pid,w in snap["workers"].items()]
+        lines.append("# TYPE parkersquare_worker_rss_bytes gauge")
+        lines += [f'parkersquare_worker_rss_bytes{{pid="{pid}"}} {w["rss"]}' for pid,w in snap["workers"].items()]
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
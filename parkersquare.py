@@ -1,12 +1,28 @@
 #!/usr/bin/env python3
 
+import os
+import sys
 import math
+import json
+import time
+import signal
+import decimal
+import argparse
 import itertools
+import bisect
+import heapq
+import collections
 from datetime import datetime
-import timeit
 import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
 
 import factors
+import assembly
+import cengine
+import metrics
+import results
 
 
 ###############################################################################
@@ -39,14 +55,25 @@ def _getsumsquares_direct(n):
     return pairs
 
 
-def getsumsquares(fac):
+def getsumsquares(fac, roots=False):
     """Given the prime factorization of a number, n, find all pairs of 
-    square numbers A = a^2 and B = b^2 where 0 < A < B and A + B = n."""
+    square numbers A = a^2 and B = b^2 where 0 < A < B and A + B = n.
+    If roots, return the pairs (a,b) instead."""
+    stats = metrics.active()
+    if stats is not None:
+        begin = time.perf_counter()
     try:
-        pairs_sqrt = factors.getsumsquares(fac)
+        pairs_sqrt = factors.getcanonicalsumsquares(fac)
+        if stats is not None:
+            stats.time("pairs", time.perf_counter() - begin)
     except factors.FactorException:
         print(f"Falling back to slow sum of squares enumeration for {factors.tostring(fac)}", flush=True)
         pairs_sqrt = _getsumsquares_direct(factors.getnum(fac))
+        if stats is not None:
+            stats.time("fallback", time.perf_counter() - begin)
+            stats.count("fallbacks")
+    if roots:
+        return [(a, b) for a,b in pairs_sqrt if (0 < a) and (a < b)]
     return [(a**2, b**2) for a,b in pairs_sqrt if (0 < a) and (a < b)]
 
 
@@ -56,11 +83,15 @@ def getbestsquare(pairs):
     """Check if a magic square can be constructed from the given
     pairs of numbers (a,b) such that a and b are square numbers
     and a + b = n for a common n. Return a square if one exists,
-    if not, return an "hourglass" if one exists.
+    if not, return an "hourglass" if one exists. The pairs may be in any
+    order, and ties are broken in that order.
     """
+    if isinstance(pairs, PairArray):
+        return assembly.bestsquare(None, pairs.k, pairs.a)
+    if len(pairs) >= PairArray.SMALL:
+        return assembly.bestsquare([a for a,b in pairs], pairs[0][0] + pairs[0][1])
     # Find out what the common sum of the square would be
     total = (pairs[0][0] + pairs[0][1]) * 3 // 2
-    middle = total // 3
     # Place all numbers from pairs into one set
     allsquares = {num for pair in pairs for num in pair}
     # Pick two pairs to make up the corners of the magic square.
@@ -77,45 +108,135 @@ def getbestsquare(pairs):
         # Save if this is a good square
         if numfit > bestfit:
             bestfit = numfit
-            bestsquare = [
-                [corners1[0], top,                  corners2[0]          ],
-                [left,        middle,               total - middle - left],
-                [corners2[1], total - middle - top, corners1[1]          ]
-            ]
+            bestsquare = _square(total, corners1, corners2, top, left)
         if bestfit == 2:
             break
     return bestfit, bestsquare
 
 
-def getborderpairs(fac):
+def _square(total, corners1, corners2, top, left):
+    """Fill in the square with the given corner pairs, top and left."""
+    middle = total // 3
+    return [
+        [int(corners1[0]), int(top),                  int(corners2[0])          ],
+        [int(left),        int(middle),               int(total - middle - left)],
+        [int(corners2[1]), int(total - middle - top), int(corners1[1])          ]
+    ]
+
+
+class PairArray:
+    """Compact form of the border pairs of one candidate, as returned by
+    getborderpairs(fac, compact=True). The roots a < b of each pair are kept
+    in two sorted int64 arrays, and the squares are only computed when a
+    pair is read. Behaves like the list of pairs of squares otherwise.
+    getbestsquare assembles these with the engine in assembly.py straight
+    from the roots, without building the squares."""
+
+    # Below this many pairs, trying every arrangement of corners directly is
+    # quicker than assembly.py
+    SMALL = 24
+
+    def __init__(self, roots):
+        self.a = np.array([a for a,b in roots], dtype=np.int64)
+        self.b = np.array([b for a,b in roots], dtype=np.int64)
+        # Both roots of any pair give k
+        self.k = int(self.a[0]) ** 2 + int(self.b[0]) ** 2
+
+    def __len__(self):
+        return len(self.a)
+
+    def __getitem__(self, i):
+        return (int(self.a[i]) ** 2, int(self.b[i]) ** 2)
+
+    def __iter__(self):
+        return ((a*a, b*b) for a,b in zip(self.a.tolist(), self.b.tolist()))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+
+def getborderpairs(fac, compact=False):
     """For a number m representing the square root of the central value
     of the Parker square, passed to this function in terms of its prime
     factorization, find the possible pairs of squares to surround
     the center value. These are the unique ways two squares can add to
     2*m^2, if four such unique ways exist. If they exist, return a list
-    of tuples of all these pairs. If they don't exist, return None."""
+    of tuples of all these pairs. If they don't exist, return None. If
+    compact, return a PairArray instead of a list when there are enough
+    pairs for it to be quicker and the roots fit in 64 bits."""
     # Adjust the prime factorization to be for 2m^2
     fac = {p:2*e for p,e in fac.items()}
     fac[2] = fac.get(2, 0) + 1
+    stats = metrics.active()
+    if stats is not None:
+        begin = time.perf_counter()
     numways = (factors.countsumsquares(fac) - 4) // 8 # remove irrelevant pairs
+    if stats is not None:
+        stats.time("jacobi", time.perf_counter() - begin)
     if numways < 4:
         return None
     # If there theoretically are 4 pairs, find them
-    pairs = getsumsquares(fac)
+    # Roots of pairs summing to 2m^2 are below sqrt(2m^2)
+    compact = compact and (numways >= PairArray.SMALL) and (factors.getnum(fac) < 2**126)
+    pairs = getsumsquares(fac, roots=compact)
     if len(pairs) != numways:
         raise Exception(f"Expected {numways} pairs, got {len(pairs)}")
-    return pairs
+    # Sort so that the order pairs are tried in does not depend on how they
+    # were generated (the C engine sorts the same way)
+    pairs.sort()
+    return PairArray(pairs) if compact else pairs
+
+
+def getbestcells(pairs):
+    """Return a tuple cells,square for the arrangement of the given border
+    pairs in the corners whose square has the most perfect squares among
+    its nine cells, counting every cell and not only those completed by
+    other border pairs (see assembly.squarecells). Return 5,None if no
+    arrangement has more than the middle and the four corners."""
+    cells, square = assembly.squarecells([a for a,b in pairs], pairs[0][0] + pairs[0][1])
+    return (cells, square) if cells > 5 else (5, None)
 
 
-def check_middle(fac):
+def check_middle(fac, cells=False):
     """Check one square rooted middle number, given in terms of its prime
     factorization, for any parker squares that could work. Return a tuple of
     fac,index,square where fac is the original argument, index is 0 if no
     square is found, 1 if an 'hourglass' is found, and 2 if a full square 
-    is found. For 1 or 2, the square is last, otherwise None."""
-    pairs = getborderpairs(fac)
+    is found. For 1 or 2, the square is last, otherwise None.
+
+    If cells, also look for near misses with getbestcells, which takes
+    several times as long, and return a tuple fac,index,square,cells where
+    cells is the most perfect squares among the nine cells of any
+    arrangement. If index is 0, square is then that arrangement, or None if
+    cells is 5."""
+    pairs = getborderpairs(fac, compact=True)
+    result = check_pairs(fac, pairs)
+    if not cells:
+        return result
+    if pairs is None:
+        return (*result, 5)
+    stats = metrics.active()
+    begin = time.perf_counter()
+    count, cellsquare = getbestcells(pairs)
+    if stats is not None:
+        stats.time("cells", time.perf_counter() - begin)
+        stats.count(f"cells{count}")
+    fac, fit, square = result
+    return fac, fit, (square if fit > 0 else cellsquare), count
+
+
+def check_pairs(fac, pairs):
+    """Finish check_middle for fac given its border pairs, as returned by
+    getborderpairs."""
     if pairs is not None:
-        return (fac,*getbestsquare(pairs))
+        stats = metrics.active()
+        if stats is None:
+            return (fac,*getbestsquare(pairs))
+        begin = time.perf_counter()
+        fit,square = getbestsquare(pairs)
+        stats.time("assembly", time.perf_counter() - begin)
+        stats.count(f"fit{fit}")
+        return (fac,fit,square)
     else:
         return (fac,0,None)
 
@@ -124,89 +245,545 @@ def check_middle(fac):
 def square_sqrt(square):
     return [[math.isqrt(n) for n in row] for row in square]
 
-def count_forever(start):
-    while True:
-        yield start
-        start += 1
-
-def _tobase(n, b):
-    """Convert a number n to its base b representation, expressed as a
-    tuple of base b digits from least significant to most significant."""
-    if n == 0:
-        return (0,)
-    digits = []
-    while n > 0:
-        digits.append(n % b)
-        n //= b
-    return tuple(digits)
-
-def count_by_primes():
-    """Generator that will count over tuples of increasing length representing
-    the exponents in the prime factorization of positive integers. Will count
-    every integer exactly once and reach every integer eventually. Exponents go
-    smallest prime to largest. Each tuple is assumed to have an infinite string
-    of zeros after it for exponents of all other primes."""
-    # Count every 'base' digit, base 'base' number, skipping representations
-    # that are equivalent to the ones already seen
-    for base in count_forever(2):
-        for num in range(base ** base):
-            rep = _tobase(num, base)
-            rep = rep + (0,) * (base - len(rep))
-            if (base > 2) and (rep[base-1] == 0) and all(rep[i] < base - 1 for i in range(base-1)):
-                continue
-            yield rep
-
-
-def iter_middle():
+def iter_middle(minways=4, start=1, stop=None):
     """Iterate over candidate square roots of middle numbers of the magic,
     i.e., numbers with only primes congruent to 1 mod 4 in their prime
-    factorization. Yield the prime factorizations directly."""
-    primes = (p for p in factors.primes() if p % 4 == 1)
-    cachedprimes = []
-    for exponents in count_by_primes():
-        while len(cachedprimes) < len(exponents):
+    factorization, in strictly increasing order. Yield the prime
+    factorizations directly. Candidates m for which 2m^2 cannot be written
+    as the sum of two squares in at least minways ways are skipped. Only
+    candidates with start <= m < stop are yielded (stop=None never stops).
+
+    Each candidate is a nondecreasing sequence of indices into the list of
+    primes congruent to 1 mod 4. The sequences form a tree in which a
+    node's first child appends a copy of its last index and its next
+    sibling increments its last index. Both are larger than the node, so
+    popping nodes from a heap keyed by value visits every candidate once,
+    in order. Nodes at or beyond stop are never pushed, so with a stop the
+    heap can never hold more entries than there are candidates below it.
+
+    The heap still grows about linearly with the candidates yielded (about
+    130 MB after 3*10^5 of them), and this yields about 10^4 candidates a
+    second. It is a reference enumerator for tests and small ranges;
+    search() uses iter_middle_range, whose memory is bounded by one sieve
+    segment."""
+    primes = factors.primes1mod4()
+    cachedprimes = [next(primes)]
+    # By Jacobi's theorem, 2m^2 can be written in (prod(2e+1) - 1)/2 ways
+    minprod = 2 * minways + 1
+    # Heap entries are (m, prod(2e+1), ((index,exponent), ...))
+    heap = [(cachedprimes[0], 3, ((0,1),))]
+    while heap:
+        m, prod, exps = heapq.heappop(heap)
+        if (stop is not None) and (m >= stop):
+            return
+        if (prod >= minprod) and (m >= start):
+            yield {cachedprimes[i]:e for i,e in exps}
+        i,e = exps[-1]
+        p = cachedprimes[i]
+        if i + 1 == len(cachedprimes):
             cachedprimes.append(next(primes))
-        yield {p:e for p,e in zip(cachedprimes, exponents) if e > 0}
+        q = cachedprimes[i + 1]
+        # First child: multiply by the largest prime again
+        child = exps[:-1] + ((i,e+1),)
+        if (stop is None) or (m * p < stop):
+            heapq.heappush(heap, (m * p, prod // (2*e + 1) * (2*e + 3), child))
+        # Next sibling: replace one copy of the largest prime with the next
+        if e == 1:
+            sibling = exps[:-1] + ((i+1,1),)
+            sibprod = prod
+        else:
+            sibling = exps[:-1] + ((i,e-1),(i+1,1))
+            sibprod = prod // (2*e + 1) * (2*e - 1) * 3
+        if (stop is None) or (m // p * q < stop):
+            heapq.heappush(heap, (m // p * q, sibprod, sibling))
+
+
+def iter_middle_range(lo, hi, minways=4):
+    """Iterate over the same candidates as iter_middle(minways, lo, hi), but
+    find them by sieving the interval [lo, hi) instead of walking up from 1,
+    so that the cost depends only on the length of the interval."""
+    for m,fac in factors.factorize_range(max(lo, 2), hi, only_1mod4=True, minways=minways):
+        yield fac
+
+
+def _borderpairs(pairs, numways):
+    """Turn a running list of (pair, tied) from factors._canonicalstep for
+    m^2 into what getborderpairs returns for 2m^2."""
+    pairs = sorted((a*a, b*b) for a,b in factors._canonicalfinish(pairs, 1, True) if 0 < a < b)
+    if len(pairs) != numways:
+        raise Exception(f"Expected {numways} pairs, got {len(pairs)}")
+    return pairs
+
+
+def iter_border_pairs(stop, minways=4, start=1):
+    """Iterate over the same candidates as iter_middle(minways, start, stop),
+    but depth first, yielding tuples fac,pairs where pairs is what
+    getborderpairs(fac) returns. Candidates are not in increasing order.
+
+    Each node of the search holds the partial Gaussian products for its
+    prime powers, so a child that adds one more prime power costs one
+    product step instead of building its pairs from scratch. A node m
+    whose largest prime is p has children only if m * p^2 < stop, so every
+    prime above sqrt(stop / m) makes a leaf, and these are sieved lazily
+    from [start / m, stop / m) instead of walked. Only primes below
+    sqrt(stop) are held in memory. Nodes below start are still visited if
+    they have children, but their pairs are only built when a descendant
+    needs them. There are far fewer of them than candidates, but for narrow
+    ranges far from 1 they still cost more than sieving the range does.
+    check_range(engine="tree") checks the candidates this yields."""
+    minprod = 2 * minways + 1
+    # Primes of nodes with children, all below sqrt(stop)
+    primes = list(factors.primes1mod4(5, math.isqrt(max(stop - 1, 0)) + 1))
+
+    def expand(m, prod, fac, pairs, p):
+        # pairs() returns the node's partial products, found only the first
+        # time a descendant is yielded
+        leaf = math.isqrt((stop - 1) // m) + 1
+        for q in itertools.takewhile(lambda q: q < leaf, primes[bisect.bisect_right(primes, p):]):
+            n, f = m * q, 1
+            while n < stop:
+                fac[q] = f
+                childpairs = _lazystep(pairs, q, 2 * f)
+                childprod = prod * (2*f + 1)
+                if (childprod >= minprod) and (n >= start):
+                    yield dict(fac), _borderpairs(childpairs(), (childprod - 1) // 2)
+                yield from expand(n, childprod, fac, childpairs, q)
+                del fac[q]
+                n, f = n * q, f + 1
+        # Every prime from leaf on makes a leaf, m * q^2 >= stop
+        if prod * 3 >= minprod:
+            for q in factors.primes1mod4(max(leaf, p + 1, -(-start // m)), (stop - 1) // m + 1):
+                fac[q] = 1
+                yield dict(fac), _borderpairs(factors._canonicalstep(pairs(), q, 2), (prod * 3 - 1) // 2)
+                del fac[q]
+
+    # The root, m = 1, has no pairs of its own
+    if stop > 1:
+        root = [((1,0), True)]
+        yield from expand(1, 1, {}, lambda: root, 1)
+
+
+def _lazystep(pairs, p, e):
+    """Return a function computing factors._canonicalstep(pairs(), p, e) the
+    first time it is called and returning the same list afterwards."""
+    cache = []
+    def step():
+        if not cache:
+            cache.append(factors._canonicalstep(pairs(), p, e))
+        return cache[0]
+    return step
+
+
+def check_range(lo, hi, keepall=False, engine="python", mincells=None):
+    """Check every candidate m with lo <= m < hi for parker squares. Return
+    a tuple lo,hi,count,hits,elapsed,stats where count is the number of
+    candidates checked, hits is a list of the results of check_middle that
+    found an hourglass or a square (or all results, if keepall), elapsed
+    is the time taken in seconds, and stats is what metrics.collect()
+    returns. This is the unit of work given to each process in search().
+    If engine is "c", all candidates are checked in one call to the C
+    engine (see cengine.py) instead of with check_middle. If engine is
+    "tree", candidates and their border pairs come from iter_border_pairs
+    instead of sieving, and hits are sorted into increasing order of m.
+
+    If mincells is a number, candidates are checked with
+    check_middle(fac, cells=True), and those with an arrangement having at
+    least mincells perfect squares among its nine cells are also hits."""
+    if (mincells is not None) and (engine != "python"):
+        raise ValueError("Counting square cells needs the python engine.")
+    begin = time.perf_counter()
+    cachesbefore = factors.cachestats()
+    count = 0
+    hits = []
+    checking = 0.0
+    if engine == "c":
+        facs = list(iter_middle_range(lo, hi))
+        start = time.perf_counter()
+        checked = cengine.check_many(facs)
+        checking = time.perf_counter() - start
+        count = len(facs)
+        hits = [result for result in checked if keepall or (result[1] > 0)]
+    elif engine == "tree":
+        for fac,pairs in iter_border_pairs(hi, start=lo):
+            count += 1
+            start = time.perf_counter()
+            result = check_pairs(fac, pairs)
+            checking += time.perf_counter() - start
+            if keepall or (result[1] > 0):
+                hits.append(result)
+        hits.sort(key=lambda result: factors.getnum(result[0]))
+    else:
+        for fac in iter_middle_range(lo, hi):
+            count += 1
+            start = time.perf_counter()
+            result = check_middle(fac, cells=mincells is not None)
+            checking += time.perf_counter() - start
+            if keepall or (result[1] > 0) or ((mincells is not None) and (result[3] >= mincells)):
+                hits.append(result)
+    elapsed = time.perf_counter() - begin
+    stats = metrics.active()
+    if stats is not None:
+        # Everything outside checking is finding candidates (and, for the
+        # tree, their pairs)
+        stats.time("factorize", elapsed - checking)
+        for name,info in factors.cachestats().items():
+            stats.count(f"{name}_hits", info["hits"] - cachesbefore[name]["hits"])
+            stats.count(f"{name}_misses", info["misses"] - cachesbefore[name]["misses"])
+    return lo, hi, count, hits, elapsed, metrics.collect()
+
+
+def save_checkpoint(path, state):
+    """Atomically write the search state (a JSON-serializable dictionary) to
+    path. The state is written to a temporary file which then replaces the
+    checkpoint, so a crash never leaves a partially written checkpoint."""
+    tmppath = f"{path}.tmp"
+    with open(tmppath, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmppath, path)
+
 
+def load_checkpoint(path):
+    """Read a search state previously written by save_checkpoint."""
+    with open(path) as f:
+        return json.load(f)
 
-def search(procs=None):
+
+def _init_worker(collectmetrics=False, primetable=None):
+    """Pool worker initializer. Leave Ctrl-C to the parent process, which
+    shuts the pool down itself, and let SIGTERM kill the worker even if it
+    was forked after search() installed its own handler. Optionally start
+    recording metrics, and map the shared prime table."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if collectmetrics:
+        metrics.enable()
+    if primetable is not None:
+        factors.use_primetable(primetable)
+
+
+def _init_thread(collectmetrics=False, primetable=None):
+    """Initializer for the workers of the thread and inline executors, which
+    share the process with search() and so leave its signals alone."""
+    if collectmetrics:
+        metrics.enable()
+    if primetable is not None:
+        factors.use_primetable(primetable)
+
+
+class _InlineResult:
+    """What InlinePool.apply_async returns, holding a finished result."""
+
+    def __init__(self, func, args):
+        try:
+            self.value, self.error = func(*args), None
+        except Exception as e:
+            self.value, self.error = None, e
+
+    def get(self, timeout=None):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class InlinePool:
+    """Stand-in for multiprocessing.Pool that runs every task in the calling
+    thread as soon as it is submitted, so that the whole search can be
+    profiled and runs in a deterministic order."""
+
+    def __init__(self, processes=None, initializer=None, initargs=()):
+        if initializer is not None:
+            initializer(*initargs)
+
+    def apply_async(self, func, args=()):
+        return _InlineResult(func, args)
+
+    def starmap(self, func, iterable):
+        return [func(*args) for args in iterable]
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+EXECUTORS = ["process", "thread", "inline"]
+
+
+def make_pool(executor="process", procs=None, collectmetrics=False, primetable=None):
+    """Return a pool of procs workers for search(), with the interface of
+    multiprocessing.Pool. The executor is one of EXECUTORS: "process" for
+    worker processes, "thread" for worker threads, which only run in
+    parallel on a free-threaded build of Python but share the caches of
+    primes and need no pickling, or "inline" for InlinePool."""
+    if executor == "process":
+        return mp.Pool(procs, initializer=_init_worker, initargs=(collectmetrics, primetable))
+    elif executor == "thread":
+        if getattr(sys, "_is_gil_enabled", lambda: True)():
+            print("Warning: the GIL is enabled, so worker threads will not run in parallel.",
+                  file=sys.stderr, flush=True)
+        return ThreadPool(procs, initializer=_init_thread, initargs=(collectmetrics, primetable))
+    elif executor == "inline":
+        return InlinePool(procs, initializer=_init_thread, initargs=(collectmetrics, primetable))
+    raise ValueError(f"Unknown executor {executor}, expected one of {EXECUTORS}")
+
+
+def shard_range(start, end, shard, shards):
+    """Return the interval lo,hi that is shard number 'shard' (counting from
+    0) when [start, end) is split into 'shards' contiguous pieces of nearly
+    equal length."""
+    if not 0 <= shard < shards:
+        raise ValueError(f"Shard {shard} is not in 0..{shards - 1}")
+    return (start + (end - start) * shard // shards,
+            start + (end - start) * (shard + 1) // shards)
+
+
+def search(procs=None, checkpoint=None, resume=False, interval=300, tasktime=2.0,
+           metricsfile=None, metricsport=None, metricsinterval=60,
+           resultsdb=None, storeall=False, engine="python", start=1, end=None,
+           primetable=None, executor="process", mincells=None):
     """Search for Parker Squares by enumerating prime factorizations of
-    the square root of the central number. Will return immediately if
-    a Parker Square is found, otherwise, will loop forever."""
-    
-    pool = mp.Pool(procs)
-    values = enumerate(pool.imap(check_middle, iter_middle(), chunksize=100))
-    for count,(fac,fit,square) in values:
-        # See if there are at least 4 pairs of squares that sum to 2m^2
-        #fit,square = check_middle(fac)
-        if fit == 2:
-            print(
-                "*******************",
-                f"factors.tostring(fac)",
-                "*******************",
-                "** PARKER SQUARE **",
-                "*******************", 
-                f" {square}\n = {square_sqrt(square)}^2", 
-                sep="\n", flush=True
-            )
-            return square
-        elif fit == 1:
-            print(
-                f"factors.tostring(fac)",
-                "Hourglass:",
-                f" {square}\n",
-                sep = "\n", flush = True
-            )
-        # Report progress so far
-        if (count + 1) % 100 == 0:
-            datestr = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            print(f"{datestr} #{count+1}: {factors.tostring(fac)} = {factors.getnum(fac)}", flush=True)
+    the square root of the central number, for square roots m with
+    start <= m < end. Will return immediately if a Parker Square is found,
+    otherwise, will loop forever if end is None, or print a summary and
+    return None once every candidate below end has been checked.
+
+    Each process is handed an interval of candidates to generate and check
+    itself (see check_range), and only sends back counts and the rare
+    hourglasses or squares. Interval lengths are adjusted so that each takes
+    about tasktime seconds.
+
+    If checkpoint is a path, the search state is saved there every
+    interval seconds and when the search stops. On SIGTERM or SIGINT, no
+    more intervals are handed out, the intervals already in the pool are
+    finished and counted, and the search stops. A second signal stops it
+    at once, losing the intervals in the pool. With resume=True, the search
+    continues from the state saved in checkpoint, if it exists. Intervals
+    whose results don't arrive within a few tasktimes of the first signal
+    are abandoned too, since a signal to the whole process group may have
+    killed their workers.
+
+    If metricsfile or metricsport are given, workers time each stage of
+    checking and send the totals back with each task. These are appended to
+    metricsfile as JSON lines every metricsinterval seconds, and served in
+    the Prometheus text format on http://localhost:metricsport/metrics.
+
+    If resultsdb is a path, every hourglass and square is stored in that
+    SQLite database (see results.py), or every candidate if storeall.
+
+    The engine is passed to check_range: "python", "c" for the C engine, or
+    "tree" for the depth first walk of iter_border_pairs.
+
+    If primetable is a path to a table built by primetable.py, every worker
+    memory-maps it instead of finding small primes and their sums of two
+    squares itself.
+
+    The executor is passed to make_pool: "process", "thread" or "inline".
+    The candidates checked and the hits found are the same with each.
+
+    If mincells is a number, near misses whose best arrangement has at
+    least mincells perfect squares among its nine cells are also reported
+    and stored (see check_range)."""
+    # 'count' is the number of candidates checked, which are all those
+    # below 'next'
+    state = {"count": 0, "next": start, "hourglasses": 0}
+    if resume and (checkpoint is not None) and os.path.exists(checkpoint):
+        state.update(load_checkpoint(checkpoint))
+        print(f"Resuming at #{state['count']}: {state['next']}", flush=True)
+
+    stopping = False
+    def stop(signum, frame):
+        nonlocal stopping
+        if stopping:
+            # Second signal: give up on the work in the pool
+            raise KeyboardInterrupt
+        stopping = True
+
+    procs = procs or os.cpu_count()
+    collectmetrics = (metricsfile is not None) or (metricsport is not None)
+    if collectmetrics:
+        reporter = metrics.Reporter(metricsfile, metricsport, metricsinterval)
+    store = None if resultsdb is None else results.ResultStore(resultsdb)
+    pool = make_pool(executor, procs, collectmetrics, primetable)
+    oldhandlers = {s:signal.signal(s, stop) for s in (signal.SIGTERM, signal.SIGINT)}
+    lastsave = lastreport = time.monotonic()
+    # Intervals are handed out in order from 'position', and results are
+    # processed in the same order so that checked candidates are contiguous
+    position = state["next"]
+    length = 10000
+    inflight = collections.deque()
+    drainuntil = None
+    begin = time.monotonic()
+    try:
+        try:
+            while True:
+                while (not stopping) and (len(inflight) < 2 * procs) and ((end is None) or (position < end)):
+                    hi = position + length if end is None else min(position + length, end)
+                    inflight.append(pool.apply_async(check_range, (position, hi, storeall, engine, mincells)))
+                    position = hi
+                if not inflight:
+                    break
+                if stopping and (drainuntil is None):
+                    # Intervals in the pool take about tasktime each, with
+                    # procs of them running at once
+                    drainuntil = time.monotonic() + 4 * tasktime + 10
+                    print(f"Stopping, finishing {len(inflight)} intervals in the pool", flush=True)
+                # Wake up regularly, since a signal sent to the whole process
+                # group may have killed a worker whose result will never arrive
+                try:
+                    lo,hi,count,hits,elapsed,stats = inflight[0].get(timeout=1)
+                except mp.TimeoutError:
+                    if stopping and (time.monotonic() > drainuntil):
+                        break
+                    continue
+                inflight.popleft()
+                # In one step, so that a second signal never splits it
+                state.update(count=state["count"] + count, next=hi)
+                if collectmetrics:
+                    reporter.add(stats, count, elapsed)
+                    reporter.maybewrite(state)
+                if store is not None:
+                    store.add(hits)
+                for fac,fit,square,*cells in hits:
+                    if fit == 2:
+                        print(
+                            "*******************",
+                            f"{factors.tostring(fac)}",
+                            "*******************",
+                            "** PARKER SQUARE **",
+                            "*******************", 
+                            f" {square}\n = {square_sqrt(square)}^2", 
+                            sep="\n", flush=True
+                        )
+                        return square
+                    elif fit == 1:
+                        state["hourglasses"] += 1
+                        print(
+                            f"{factors.tostring(fac)}",
+                            "Hourglass:",
+                            f" {square}\n",
+                            sep = "\n", flush = True
+                        )
+                    elif cells and (mincells is not None) and (cells[0] >= mincells):
+                        print(
+                            f"{factors.tostring(fac)}",
+                            f"Near miss, {cells[0]} square cells:",
+                            f" {square}\n",
+                            sep = "\n", flush = True
+                        )
+                # Aim for tasks that take about tasktime seconds
+                scale = min(2.0, max(0.5, tasktime / max(elapsed, 1e-3)))
+                length = max(1000, int(length * scale))
+                # Report progress so far
+                if time.monotonic() - lastreport >= 10:
+                    datestr = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    print(f"{datestr} #{state['count']}: all below {state['next']} checked", flush=True)
+                    lastreport = time.monotonic()
+                # Save progress so far
+                if (checkpoint is not None) and (time.monotonic() - lastsave >= interval):
+                    save_checkpoint(checkpoint, state)
+                    lastsave = time.monotonic()
+        except KeyboardInterrupt:
+            print("Stopped again, abandoning the intervals in the pool", flush=True)
+        if stopping:
+            print(f"Stopped at #{state['count']}: {state['next']}", flush=True)
+        if checkpoint is not None:
+            save_checkpoint(checkpoint, state)
+        if end is not None:
+            print(f"Range [{start}, {end}): scanned {state['next'] - start},",
+                  f"QSS found {state['count']}, hourglasses {state['hourglasses']},",
+                  f"elapsed {time.monotonic() - begin:.1f}s", flush=True)
+    finally:
+        # Work still in the pool, if any, is past the checkpoint and will
+        # be redone
+        pool.terminate()
+        pool.join()
+        if collectmetrics:
+            reporter.close()
+            if executor == "inline":
+                metrics.disable()
+        if store is not None:
+            store.close()
+        for s,handler in oldhandlers.items():
+            signal.signal(s, handler)
 
 ###############################################################################
 
+def _parseint(s):
+    """Parse an integer given in decimal or scientific notation, e.g. 5e7."""
+    try:
+        n = decimal.Decimal(s)
+    except decimal.InvalidOperation:
+        raise argparse.ArgumentTypeError(f"{s} is not a number")
+    if not n.is_finite() or n != n.to_integral_value():
+        raise argparse.ArgumentTypeError(f"{s} is not an integer")
+    return int(n)
+
+
+def _parseshard(s):
+    """Parse a shard given as i/N."""
+    try:
+        shard, shards = (int(x) for x in s.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{s} is not of the form i/N")
+    if not 0 <= shard < shards:
+        raise argparse.ArgumentTypeError(f"shard {shard} is not in 0..{shards - 1}")
+    return shard, shards
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Search for Parker squares.")
+    parser.add_argument("--start", type=_parseint, default=1,
+                        help="smallest square root of the middle number to check (default: 1)")
+    parser.add_argument("--end", type=_parseint, default=None,
+                        help="stop before this square root of the middle number (default: never)")
+    parser.add_argument("--shard", type=_parseshard, default=None,
+                        help="check only piece i of N (counting from 0) of [--start, --end)")
+    parser.add_argument("--procs", type=int, default=None,
+                        help="number of worker processes (default: all CPUs)")
+    parser.add_argument("--checkpoint", default=None,
+                        help="file in which to periodically save progress")
+    parser.add_argument("--interval", type=float, default=300,
+                        help="seconds between checkpoints (default: 300)")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue from the state saved in --checkpoint")
+    parser.add_argument("--tasktime", type=float, default=2.0,
+                        help="target seconds of work per task (default: 2)")
+    parser.add_argument("--metrics", default=None,
+                        help="file to append JSON lines of per-stage metrics to")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics on this localhost port")
+    parser.add_argument("--metrics-interval", type=float, default=60,
+                        help="seconds between metrics records (default: 60)")
+    parser.add_argument("--results", default=None,
+                        help="SQLite database in which to store hourglasses and squares")
+    parser.add_argument("--store-all", action="store_true",
+                        help="store every candidate in --results, not just hourglasses")
+    parser.add_argument("--engine", choices=["python", "c", "tree"], default="python",
+                        help="check candidates in Python, with the C library in c/src, or by"
+                        " walking the tree of candidates depth first")
+    parser.add_argument("--primes", default=None,
+                        help="prime table built by primetable.py to share between workers")
+    parser.add_argument("--mincells", type=int, default=None,
+                        help="also report arrangements with at least this many square cells"
+                             " of nine (slower)")
+    parser.add_argument("--executor", choices=EXECUTORS, default="process",
+                        help="run workers as processes, threads (for free-threaded Python),"
+                             " or inline in one thread for profiling (default: process)")
+    args = parser.parse_args()
+    start, end = args.start, args.end
+    if args.shard is not None:
+        if end is None:
+            parser.error("--shard requires --end")
+        start, end = shard_range(start, end, *args.shard)
     #import cProfile
     #cProfile.run('search()')
-    search()
-
-
+    search(procs=args.procs, checkpoint=args.checkpoint, resume=args.resume,
+           interval=args.interval, tasktime=args.tasktime,
+           metricsfile=args.metrics, metricsport=args.metrics_port,
+           metricsinterval=args.metrics_interval,
+           resultsdb=args.results, storeall=args.store_all, engine=args.engine,
+           start=start, end=end, primetable=args.primes, executor=args.executor,
+           mincells=args.mincells)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""Build the table of primes p == 1 (mod 4) below a limit, with the pair
+0 < a < b such that a^2 + b^2 == p for each, used by factors.use_primetable.
+The table is a NumPy .npy file of factors.PRIMETABLE_DTYPE records, 16 bytes
+per prime, ending with the record (limit, 0, 0). Building it once lets every
+worker of a search memory-map the same copy instead of sieving and running
+Cornacchia's algorithm for itself."""
+
+import os
+import argparse
+
+import numpy as np
+
+import factors
+
+
+def build(path, limit):
+    """Write the table of primes 1 mod 4 below limit to path, replacing it
+    atomically. Return the number of primes written."""
+    if limit >= 2**64:
+        raise ValueError("Prime table limit must be below 2^64.")
+    blocks = []
+    rows = []
+    for p,(a,b) in factors.primesumsquares_range(2, limit):
+        rows.append((p, a, b))
+        if len(rows) == factors.SEGMENT_SIZE:
+            blocks.append(np.array(rows, dtype=factors.PRIMETABLE_DTYPE))
+            rows = []
+    rows.append((limit, 0, 0))
+    blocks.append(np.array(rows, dtype=factors.PRIMETABLE_DTYPE))
+    table = np.concatenate(blocks)
+    tmppath = f"{path}.tmp.npy"
+    np.save(tmppath, table)
+    os.replace(tmppath, path)
+    return len(table) - 1
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the shared table of primes 1 mod 4.")
+    parser.add_argument("path", help="file to write, e.g. primes.npy")
+    parser.add_argument("--limit", type=float, default=1e8,
+                        help="include primes below this (default: 1e8)")
+    args = parser.parse_args()
+    count = build(args.path, int(args.limit))
+    print(f"Wrote {count} primes below {int(args.limit)} to {args.path}")
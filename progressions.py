@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""A second search engine, which finds the border pairs of every middle
+number in a range at once instead of one middle number at a time. Each
+line through the middle of a magic square of squares is an arithmetic
+progression of three squares x^2, c^2, z^2 centred on c = r22, and these
+are parametrized like Pythagorean triples: with u = (z + x)/2 and
+v = (z - x)/2, u^2 + v^2 = c^2. So every primitive triple
+(m^2 - n^2, 2mn, m^2 + n^2), scaled by s, gives the progression with
+c = s(m^2 + n^2) and x = s|m^2 - n^2 - 2mn|, and every progression arises
+this way exactly once.
+
+The progressions with centres in the range are streamed into a table keyed
+by centre, which spills to disk when it grows past a bound. Centres that
+gather enough progressions are the candidates of check_range, and only
+those are factorized, one sieved segment at a time, and passed on to
+getbestsquare.
+
+Besides one step per progression, enumerating them costs about hi^(2/3)
+for a range ending at hi, however narrow the range. check_progressions
+refuses ranges narrower than hi^(2/3) / MAX_OVERHEAD, where that fixed
+cost would dominate and check_range is much quicker."""
+
+import os
+import math
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+import factors
+import metrics
+import parkersquare
+
+
+# Largest ratio of hi^(2/3) to the length of the range that
+# check_progressions accepts
+MAX_OVERHEAD = 100
+
+
+def _expand(first, counts):
+    """Return the array of the runs first[i], first[i] + 1, ... of length
+    counts[i], one after another, and the index i of the run of each."""
+    starts = np.cumsum(counts) - counts
+    run = np.repeat(np.arange(len(counts)), counts)
+    return np.arange(len(run)) - starts[run] + first[run], run
+
+
+def _isqrt(x):
+    """Exact integer square roots of an int64 array of values below 2^62."""
+    r = np.sqrt(x.astype(np.float64)).astype(np.int64)
+    r -= r * r > x
+    r += (r + 1) * (r + 1) <= x
+    return r
+
+
+def _primitive(m, n):
+    """Mask of the pairs m > n > 0 giving primitive triples: coprime and of
+    opposite parity."""
+    return ((m - n) % 2 == 1) & (np.gcd(m, n) == 1)
+
+
+def _progressions(m, n, s):
+    """Centres c and smallest roots x of the progressions given by m, n, s."""
+    return s * (m * m + n * n), s * np.abs(m * m - n * n - 2 * m * n)
+
+
+def iter_progressions(lo, hi):
+    """Iterate over every progression of three squares x^2 < c^2 < z^2 with
+    lo <= c < hi, in blocks. Yield tuples c,x of int64 arrays. Centres must
+    be below 2^62.
+
+    Small m, up to about hi^(1/3), have many scales s of each hypotenuse
+    h = m^2 + n^2 in the range, so each n is taken in turn and gets every
+    scale at once. Larger m have few scales, so each scale s is taken in
+    turn and gets only the n with s * h in the range, found from square
+    roots. Every m, n, s enumerated either way gives a progression or is
+    about to, so the cost is about hi^(2/3) on top of one step per
+    progression, rather than the hi/4 of trying every n for every m."""
+    if hi >= 2**62:
+        raise ValueError("Centres of progressions must be below 2^62.")
+    lo = max(lo, 1)
+    if hi <= lo:
+        return
+    split = max(2, round(hi ** (1/3)))
+    for m in range(2, min(split, math.isqrt(hi) + 1)):
+        n = np.arange(1, m, dtype=np.int64)
+        n = n[_primitive(m, n) & (m * m + n * n < hi)]
+        # Scales s with lo <= s * h < hi
+        h = m * m + n * n
+        first = -(-lo // h)
+        s, run = _expand(first, np.maximum((hi - 1) // h - first + 1, 0))
+        if len(s):
+            yield _progressions(np.int64(m), n[run], s)
+    ms = np.arange(split, math.isqrt(hi) + 1, dtype=np.int64)
+    # Hypotenuses with a given m lie in [m^2 + 1, m^2 + (m - 1)^2]
+    firsts = -(-lo // (ms * ms + (ms - 1) * (ms - 1)))
+    counts = np.maximum((hi - 1) // (ms * ms + 1) - firsts + 1, 0)
+    for i,j in _chunks(counts):
+        s, run = _expand(firsts[i:j], counts[i:j])
+        m = ms[i:j][run]
+        # n with lo <= s * (m^2 + n^2) < hi, and 0 < n < m
+        low = np.maximum(-(-lo // s) - m * m, 1)
+        nfirst = _isqrt(low - 1) + 1
+        nlast = np.minimum(_isqrt(np.maximum((hi - 1) // s - m * m, 0)), m - 1)
+        ncounts = np.maximum(nlast - nfirst + 1, 0)
+        # Each m, s may have many n, so these are split into blocks again
+        for k,l in _chunks(ncounts):
+            n, run = _expand(nfirst[k:l], ncounts[k:l])
+            mm, ss = m[k:l][run], s[k:l][run]
+            keep = _primitive(mm, n)
+            if np.any(keep):
+                yield _progressions(mm[keep], n[keep], ss[keep])
+
+
+def _chunks(counts, size=2**20):
+    """Generator of index ranges i,j splitting counts into pieces whose sum
+    is about size, or a single index where one count alone exceeds it."""
+    cumulative = np.cumsum(counts)
+    i = 0
+    while i < len(counts):
+        j = int(np.searchsorted(cumulative, cumulative[i] - counts[i] + size, side="right"))
+        j = max(j, i + 1)
+        yield i, j
+        i = j
+
+
+class SpillTable:
+    """Table of progressions c,x keyed by the centre c, for centres with
+    lo <= c < hi. Progressions are buffered in memory, and once more than
+    'memory' of them are buffered, they are appended to one of 'partitions'
+    files in 'directory', each holding the centres of one of 'partitions'
+    equal pieces of the range. Every progression with a given centre
+    therefore ends up in one partition, and the partitions are grouped one
+    at a time, so about 1/partitions of the progressions are in memory at
+    once. Use as a context manager to remove the files afterwards."""
+
+    def __init__(self, lo, hi, memory=2**22, partitions=64, directory=None):
+        self.lo = lo
+        self.width = max(-(-(hi - lo) // partitions), 1)
+        self.memory = memory
+        self.partitions = partitions
+        self.buffered = []
+        self.numbuffered = 0
+        self.spilled = 0
+        self._tmpdir = tempfile.TemporaryDirectory(dir=directory, prefix="progressions-")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._tmpdir.cleanup()
+
+    def _path(self, part):
+        return os.path.join(self._tmpdir.name, f"{part}.bin")
+
+    def add(self, c, x):
+        """Add arrays of centres c and values x of progressions."""
+        self.buffered.append(np.stack([c, x], axis=1))
+        self.numbuffered += len(c)
+        if self.numbuffered > self.memory:
+            self._spill()
+
+    def _spill(self):
+        if not self.buffered:
+            return
+        records = np.concatenate(self.buffered)
+        self.buffered = []
+        self.numbuffered = 0
+        part = (records[:,0] - self.lo) // self.width
+        order = np.argsort(part, kind="stable")
+        records, part = records[order], part[order]
+        bounds = np.searchsorted(part, np.arange(self.partitions + 1))
+        for i in range(self.partitions):
+            if bounds[i] < bounds[i + 1]:
+                with open(self._path(i), "ab") as f:
+                    records[bounds[i]:bounds[i + 1]].tofile(f)
+        self.spilled += len(records)
+
+    def _parts(self):
+        """Iterate over arrays of records holding every progression of the
+        centres they contain."""
+        if self.spilled == 0:
+            if self.buffered:
+                yield np.concatenate(self.buffered)
+            return
+        self._spill()
+        for i in range(self.partitions):
+            if os.path.exists(self._path(i)):
+                yield np.fromfile(self._path(i), dtype=np.int64).reshape(-1, 2)
+
+    def groups(self, minways):
+        """Iterate over tuples c,x for every centre c with at least minways
+        progressions, in increasing order of c, where x is the list of their
+        smallest roots in increasing order."""
+        for records in self._parts():
+            records = records[np.lexsort((records[:,1], records[:,0]))]
+            c = records[:,0]
+            starts = np.flatnonzero(np.r_[True, c[1:] != c[:-1]])
+            counts = np.diff(np.r_[starts, len(c)])
+            for first,count in zip(starts[counts >= minways].tolist(), counts[counts >= minways].tolist()):
+                yield int(c[first]), records[first:first + count, 1].tolist()
+
+
+def check_progressions(lo, hi, keepall=False, minways=4, memory=2**22, directory=None):
+    """Check every candidate m with lo <= m < hi for parker squares, as
+    check_range does, but finding the border pairs of all of them at once
+    from the progressions of squares centred in the range. Return the same
+    tuple lo,hi,count,hits,elapsed,stats as check_range, with hits in
+    increasing order of m. Centres with a prime factor that is not 1 mod 4
+    are multiples of a smaller candidate, with the same squares scaled up,
+    so they are skipped as check_range skips them. Which centres are
+    candidates, and their factorizations, come from sieving the segments of
+    the range holding centres with enough progressions, one at a time. At
+    most about 'memory' progressions are held in memory, the rest spill to
+    a temporary directory inside 'directory'.
+    Raises ValueError for ranges too narrow for their magnitude (see
+    MAX_OVERHEAD)."""
+    if hi ** (2/3) > MAX_OVERHEAD * (hi - lo):
+        raise ValueError(f"The range [{lo}, {hi}) is too narrow for progressions, use a range"
+                         f" of at least {math.ceil(hi ** (2/3) / MAX_OVERHEAD)} or check_range.")
+    begin = time.perf_counter()
+    stats = metrics.active()
+    count = 0
+    hits = []
+    with SpillTable(lo, hi, memory, directory=directory) as table:
+        for c,x in iter_progressions(lo, hi):
+            table.add(c, x)
+        if stats is not None:
+            stats.time("progressions", time.perf_counter() - begin)
+            stats.count("progressions_spilled", table.spilled)
+        # Factorizations of the candidates in the segment [segment, segend)
+        candidates = {}
+        segend = lo
+        for c,x in table.groups(minways):
+            if c >= segend:
+                segment = c - (c - lo) % factors.SEGMENT_SIZE
+                segend = min(segment + factors.SEGMENT_SIZE, hi)
+                candidates = dict(factors.factorize_range(
+                    max(segment, 2), segend, only_1mod4=True, minways=minways))
+            fac = candidates.get(c)
+            if fac is None:
+                continue
+            count += 1
+            k = 2 * c * c
+            result = parkersquare.check_pairs(fac, [(a * a, k - a * a) for a in x])
+            if keepall or (result[1] > 0):
+                hits.append(result)
+    hits.sort(key=lambda result: factors.getnum(result[0]))
+    return lo, hi, count, hits, time.perf_counter() - begin, metrics.collect()
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Search a range for Parker squares by progressions of squares.")
+    parser.add_argument("start", type=parkersquare._parseint,
+                        help="smallest square root of the middle number to check")
+    parser.add_argument("end", type=parkersquare._parseint,
+                        help="stop before this square root of the middle number")
+    parser.add_argument("--minways", type=int, default=4,
+                        help="progressions a centre needs to be checked (default: 4)")
+    parser.add_argument("--memory", type=parkersquare._parseint, default=2**22,
+                        help="progressions held in memory before spilling to disk (default: 2^22)")
+    parser.add_argument("--tmpdir", default=None,
+                        help="directory for spilled progressions (default: system temporary)")
+    parser.add_argument("--compare", action="store_true",
+                        help="also check the range with check_range and compare")
+    args = parser.parse_args()
+    try:
+        lo,hi,count,hits,elapsed,stats = check_progressions(
+            args.start, args.end, minways=args.minways, memory=args.memory, directory=args.tmpdir)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Progressions: {count} centres with at least {args.minways} progressions,",
+          f"{sum(fit == 1 for fac,fit,square in hits)} hourglasses,",
+          f"{sum(fit == 2 for fac,fit,square in hits)} squares, {elapsed:.1f}s")
+    if args.compare:
+        lo,hi,count,hits,elapsed,stats = parkersquare.check_range(args.start, args.end)
+        print(f"check_range:  {count} candidates,",
+              f"{sum(fit == 1 for fac,fit,square in hits)} hourglasses,",
+              f"{sum(fit == 2 for fac,fit,square in hits)} squares, {elapsed:.1f}s")
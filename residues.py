@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Module computing which residues mod m are squares, and which are sums of
+two squares, as NumPy boolean arrays. These tables are filters: an integer
+whose residue is not in the table can't be a square (or a sum of two
+squares), so the moduli rejecting the most residues make the best filters.
+
+The sums of two squares are the support of the cyclic convolution of the
+indicator of squares with itself, found with an FFT in O(m log m) instead
+of adding every pair of residues. Both numbers of residues are
+multiplicative by the Chinese remainder theorem, so scan() only builds
+tables for prime powers and sieves the ratios for every other modulus,
+splitting the moduli among processes."""
+
+import math
+import argparse
+import functools
+import multiprocessing as mp
+
+import numpy as np
+
+import factors
+
+
+def squares(m):
+    """Boolean array t of length m with t[r] true exactly when r is a square
+    mod m."""
+    table = np.zeros(m, dtype=bool)
+    i = np.arange(m, dtype=np.int64)
+    table[i * i % m] = True
+    return table
+
+
+def sumsquares(m, table=None):
+    """Boolean array t of length m with t[r] true exactly when r is a sum of
+    two squares mod m. If table is given, it is used instead of squares(m),
+    giving the sums of two residues from any table."""
+    if table is None:
+        table = squares(m)
+    # The linear convolution, padded to a power of two for a fast FFT, is
+    # folded back mod m. Entries count the ways to write r as a sum, so are
+    # near integers.
+    n = 1 << (2 * m - 1).bit_length()
+    f = np.fft.rfft(table.astype(np.float64), n)
+    full = np.fft.irfft(f * f, n)
+    counts = full[:m].copy()
+    counts[:m - 1] += full[m:2 * m - 1]
+    return counts > 0.5
+
+
+def reducing(p):
+    """Return True if two squares can only sum to 0 mod p^2 when both are 0
+    mod p^2. A middle number divisible by p^2 for such a prime p makes every
+    number of the square divisible by p^2, so the square can be reduced."""
+    table = squares(p * p)
+    table[0] = False
+    return not np.any(table & table[(-np.arange(p * p)) % (p * p)])
+
+
+@functools.lru_cache(maxsize=None)
+def _primepowercounts(p, e):
+    """Numbers of squares and of sums of two squares mod p^e."""
+    if (p > 2) and (e == 1):
+        # Half the nonzero residues mod an odd prime are squares, and every
+        # residue is a sum of two squares
+        return (p + 1) // 2, p
+    table = squares(p**e)
+    if p % 4 == 1:
+        # With i^2 = -1 mod p^e, r = ((r+1)/2)^2 + ((r-1)/2i)^2
+        return int(np.count_nonzero(table)), p**e
+    return int(np.count_nonzero(table)), int(np.count_nonzero(sumsquares(p**e, table)))
+
+
+def scan_range(lo, hi):
+    """Return arrays moduli,squareratio,sumratio for every modulus m with
+    lo <= m < hi, where the ratios are the fractions of residues mod m that
+    are squares and sums of two squares. The counts are sieved: for every
+    prime power q = p^e with p^2 < hi, the multiples of q in the range have
+    the counts for p^(e-1) replaced by those for p^e, and what is left of m
+    after dividing out those primes is 1 or a single larger prime."""
+    lo = max(lo, 2)
+    moduli = np.arange(lo, max(lo, hi), dtype=np.int64)
+    counts = np.ones((2, len(moduli)), dtype=np.int64)
+    rest = moduli.copy()
+    for p in factors.primes(2, math.isqrt(hi - 1) + 1):
+        q, e = p, 1
+        previous = (1, 1)
+        while q < hi:
+            current = _primepowercounts(p, e)
+            first = -(-lo // q) * q - lo
+            for row in range(2):
+                counts[row, first::q] = counts[row, first::q] // previous[row] * current[row]
+            rest[first::q] //= p
+            q, e = q * p, e + 1
+            previous = current
+    large = rest > 1
+    counts[0, large] *= (rest[large] + 1) // 2
+    counts[1, large] *= rest[large]
+    return moduli, counts[0] / moduli, counts[1] / moduli
+
+
+def scan(lo, hi, procs=None, chunk=2**16):
+    """Return the same arrays as scan_range(lo, hi), splitting [lo, hi) into
+    pieces of chunk moduli among procs processes (default: all CPUs)."""
+    bounds = list(range(lo, hi, chunk)) + [hi]
+    with mp.Pool(procs) as pool:
+        pieces = pool.starmap(scan_range, zip(bounds, bounds[1:]))
+    return tuple(np.concatenate(arrays) for arrays in zip(*pieces))
+
+
+def records(moduli, ratio):
+    """Return the moduli whose ratio is smaller than that of every smaller
+    modulus, with their ratios, as in exploration/sumsquaremods.py."""
+    running = np.minimum.accumulate(ratio)
+    new = np.r_[True, running[1:] < running[:-1]]
+    return moduli[new], ratio[new]
+
+
+def save_tables(path, moduli):
+    """Save the tables of squares and sums of two squares mod each modulus to
+    path as a NumPy .npz file, for load_tables."""
+    arrays = {}
+    for m in moduli:
+        arrays[f"squares_{m}"] = squares(int(m))
+        arrays[f"sumsquares_{m}"] = sumsquares(int(m))
+    np.savez_compressed(path, **arrays)
+
+
+def load_tables(path):
+    """Return a dictionary {m:(squares,sumsquares)} of the tables saved to
+    path by save_tables."""
+    with np.load(path) as f:
+        moduli = sorted(int(name.split("_")[1]) for name in f.files if name.startswith("squares_"))
+        return {m:(f[f"squares_{m}"], f[f"sumsquares_{m}"]) for m in moduli}
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Scan moduli for the best square and sum of two squares filters.")
+    parser.add_argument("--limit", type=float, default=2**20,
+                        help="scan moduli below this (default: 2^20)")
+    parser.add_argument("--procs", type=int, default=None,
+                        help="number of worker processes (default: all CPUs)")
+    parser.add_argument("--output", default=None,
+                        help=".npz file to save the tables of the best moduli to")
+    parser.add_argument("--maxsize", type=float, default=2**16,
+                        help="largest modulus whose tables are saved (default: 2^16)")
+    args = parser.parse_args()
+    moduli, squareratio, sumratio = scan(2, int(args.limit), args.procs)
+    best = set()
+    for name,ratio in [("squares", squareratio), ("sums of two squares", sumratio)]:
+        print(f"Moduli with the fewest {name}:")
+        for m,r in zip(*records(moduli, ratio)):
+            print(f"{m}: {r}")
+            if m <= args.maxsize:
+                best.add(int(m))
+    if args.output is not None:
+        save_tables(args.output, sorted(best))
+        print(f"Saved tables for {len(best)} moduli to {args.output}")
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""Module containing a persistent store of the candidates checked by a
+search, kept in an SQLite database. Writes happen on a background thread in
+batches, so the search never waits for the disk. The database can be
+queried while a search is writing to it."""
+
+import json
+import queue
+import sqlite3
+import argparse
+import threading
+
+import factors
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    r22 INTEGER PRIMARY KEY,
+    factors TEXT NOT NULL,
+    numways INTEGER NOT NULL,
+    fit INTEGER NOT NULL,
+    square TEXT,
+    cells INTEGER
+);
+CREATE INDEX IF NOT EXISTS results_fit ON results (fit, r22);
+"""
+
+
+def numways(fac):
+    """Number of pairs of squares surrounding a middle number whose square
+    root has the prime factorization fac (all primes 1 mod 4), by Jacobi's
+    two-square theorem."""
+    prod = 1
+    for e in fac.values():
+        prod *= 2*e + 1
+    return (prod - 1) // 2
+
+
+def torow(result):
+    """Convert a result of check_middle to a row of the results table. The
+    number of square cells is NULL unless check_middle counted them."""
+    fac, fit, square, *cells = result
+    return (factors.getnum(fac), factors.tostring(fac), numways(fac), fit,
+            None if square is None else json.dumps(square), cells[0] if cells else None)
+
+
+def _connect(path):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    # Databases written before cells were counted lack the column
+    if "cells" not in [row[1] for row in conn.execute("PRAGMA table_info(results)")]:
+        conn.execute("ALTER TABLE results ADD COLUMN cells INTEGER")
+    return conn
+
+
+class ResultStoreException(Exception):
+    pass
+
+
+class ResultStore:
+    """Append results of check_middle to the database at path. add() only
+    queues the results; a background thread inserts everything queued in one
+    transaction at a time. Rows for an r22 already stored are replaced, so
+    repeating work after a resume is harmless.
+
+    If writing fails, the writer thread keeps the error and stops, and the
+    next call to add() or close() raises a ResultStoreException from it.
+    The batch being written and everything queued after it are not stored."""
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def _check(self):
+        if self.error is not None:
+            raise ResultStoreException(f"Storing results in {self.path} failed.") from self.error
+
+    def add(self, results):
+        """Queue a list of results of check_middle to be stored."""
+        self._check()
+        if results:
+            self.queue.put([torow(r) for r in results])
+
+    def _write(self):
+        try:
+            conn = _connect(self.path)
+        except Exception as e:
+            self.error = e
+            return
+        try:
+            done = False
+            while not done:
+                rows = []
+                batch = self.queue.get()
+                # Gather everything else already waiting into the same transaction
+                while True:
+                    if batch is None:
+                        done = True
+                    else:
+                        rows.extend(batch)
+                    try:
+                        batch = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO results VALUES (?,?,?,?,?,?)", rows)
+        except Exception as e:
+            self.error = e
+        finally:
+            conn.close()
+
+    def close(self):
+        """Write everything still queued and stop the writer thread. Raises
+        a ResultStoreException if any write failed."""
+        self.queue.put(None)
+        self.thread.join()
+        self._check()
+
+
+def query(path, lo=None, hi=None, minfit=0, mincells=None):
+    """Return rows (r22, factors, numways, fit, square, cells) from the
+    database at path with lo <= r22 < hi, fit >= minfit and, if mincells is
+    given, cells >= mincells, in order of r22. Squares are decoded from
+    JSON."""
+    conn = _connect(path)
+    clauses, params = ["fit >= ?"], [minfit]
+    if mincells is not None:
+        clauses.append("cells >= ?")
+        params.append(mincells)
+    if lo is not None:
+        clauses.append("r22 >= ?")
+        params.append(lo)
+    if hi is not None:
+        clauses.append("r22 < ?")
+        params.append(hi)
+    sql = (f"SELECT r22, factors, numways, fit, square, cells FROM results"
+           f" WHERE {' AND '.join(clauses)} ORDER BY r22")
+    rows = [(r, f, n, fit, None if s is None else json.loads(s), c)
+            for r,f,n,fit,s,c in conn.execute(sql, params)]
+    conn.close()
+    return rows
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query stored search results.")
+    parser.add_argument("database", help="results database written by search()")
+    parser.add_argument("--lo", type=int, default=None, help="smallest r22")
+    parser.add_argument("--hi", type=int, default=None, help="r22 upper bound (exclusive)")
+    parser.add_argument("--fit", type=int, default=1,
+                        help="minimum fit: 0 all, 1 hourglasses, 2 squares (default: 1)")
+    parser.add_argument("--cells", type=int, default=None,
+                        help="minimum number of square cells, for near misses")
+    args = parser.parse_args()
+    for r22,fac,ways,fit,square,cells in query(args.database, args.lo, args.hi, args.fit, args.cells):
+        print(f"{r22} = {fac}: {ways} pairs, fit {fit}, {square}"
+              + ("" if cells is None else f", {cells} square cells"))
@@ -0,0 +1,90 @@
+
+import random
+import itertools
+
+import assembly
+import parkersquare
+
+def bruteforce(asquares, k):
+    """Count the arrangements of corners with each fit, as getbestsquare
+    would try them."""
+    allsquares = set(asquares) | {k - a for a in asquares}
+    total = k * 3 // 2
+    counts = [0, 0, 0]
+    for a1,a2 in itertools.combinations(asquares, 2):
+        counts[(total - a1 - a2 in allsquares) + (total - a1 - (k - a2) in allsquares)] += 1
+    return counts
+
+# On made up pairs with many coincidences, including offsets too large for
+# machine integers, the engine agrees with trying every arrangement. The
+# large scale is odd, so the offsets are out of order once reduced mod 2^64.
+rng = random.Random(19)
+for scale in [1, 3**45]:
+    for _ in range(200):
+        middle = scale * 10**4
+        offsets = sorted(rng.sample(range(1, 300), rng.randint(2, 60)), reverse=True)
+        offsets = [scale * d for d in offsets]
+        asquares = [middle - d for d in offsets]
+        pairs = [(a, 2 * middle - a) for a in asquares]
+        fit, square, hourglasses, squares, cells = assembly.assemble(asquares, 2 * middle)
+        parkersquare.PairArray.SMALL = 10**9
+        assert (fit, square) == parkersquare.getbestsquare(pairs)
+        parkersquare.PairArray.SMALL = 24
+        assert [hourglasses, squares] == bruteforce(asquares, 2 * middle)[1:]
+        assert [h for h,i,j in assembly.triples(offsets)] == [
+            h for h,i,j in sorted(assembly.triples(offsets), key=lambda t: (t[1], t[2]))]
+        assert sorted(assembly.triples(offsets)) == sorted(
+            (h,i,j) for h,i,j in itertools.combinations_with_replacement(range(len(offsets)), 3)
+            if h < i and offsets[h] == offsets[i] + offsets[j])
+
+# Pairs in any order give the same fit and, with ties broken in that order,
+# the same square as trying every arrangement
+for _ in range(300):
+    middle = 10**4
+    pairs = [(middle - d, middle + d) for d in rng.sample(range(1, 300), 40)]
+    parkersquare.PairArray.SMALL = 10**9
+    expected = parkersquare.getbestsquare(pairs)
+    parkersquare.PairArray.SMALL = 24
+    assert parkersquare.getbestsquare(pairs) == expected
+    assert assembly.assemble([a for a,b in pairs], 2 * middle)[:2] == expected
+
+# And on every candidate up to a bound, plus some with many pairs
+facs = list(parkersquare.iter_middle(stop=200000))
+facs += [{5:4, 13:3, 17:2, 29:2}, {5:2, 13:2, 17:2, 29:1, 37:1, 41:1}]
+for fac in facs:
+    pairs = parkersquare.getborderpairs(fac)
+    asquares = [a for a,b in pairs]
+    k = sum(pairs[0])
+    fit, square, hourglasses, squares, cells = assembly.assemble(asquares, k)
+    parkersquare.PairArray.SMALL = 10**9
+    assert (fit, square) == parkersquare.getbestsquare(pairs)
+    parkersquare.PairArray.SMALL = 24
+    if len(pairs) < 40:
+        assert [hourglasses, squares] == bruteforce(asquares, k)[1:]
+
+# Straight from the int64 roots of compact pairs, with offsets that fit in
+# machine integers and offsets that don't, the result is the same
+for fac in [{5:2, 13:2, 17:1, 29:1, 37:1}, {5:2, 13:2, 17:2, 29:1, 37:1, 41:1}, {5:4, 13:4, 17:4, 29:3},
+            {5:4, 13:4, 17:2, 29:2, 37:3}]:
+    compact = parkersquare.getborderpairs(fac, compact=True)
+    assert isinstance(compact, parkersquare.PairArray)
+    asquares = [a for a,b in compact]
+    assert assembly.assemble(None, compact.k, compact.a) == assembly.assemble(asquares, compact.k)
+    assert assembly.triples([compact.k // 2 - a for a in asquares]) == assembly.triples(
+        [compact.k // 2 - a for a in asquares], assembly.rootoffsets(compact.a, compact.k))
+
+# The arrangement with the most square cells is found through the residue
+# prefilter exactly as by checking every cell
+import backend
+def mostcells(asquares, k):
+    best = (-1, None)
+    for x,y in itertools.combinations(range(len(asquares)), 2):
+        square = assembly._square(asquares, k, x, y)
+        cells = sum(1 for row in square for n in row if backend.is_square(n))
+        if cells > best[0]:
+            best = (cells, square)
+    return best
+for fac in facs[::20]:
+    pairs = parkersquare.getborderpairs(fac)
+    asquares = [a for a,b in pairs]
+    assert assembly.squarecells(asquares, sum(pairs[0])) == mostcells(asquares, sum(pairs[0]))
@@ -0,0 +1,15 @@
+
+import math
+import random
+
+import backend
+
+# The residue filter agrees with the exact square root, for both backends
+rng = random.Random(16)
+nums = list(range(-5, 20000)) + [rng.getrandbits(110) for _ in range(20000)]
+nums += [rng.getrandbits(60) ** 2 for _ in range(1000)] + [n ** 2 + 1 for n in range(1, 1000)]
+for n in nums:
+    expected = (n >= 0) and (math.isqrt(n) ** 2 == n)
+    assert backend._is_square_filtered(n) == expected
+    if n >= 0:
+        assert bool(backend.is_square(backend.mpz(n))) == expected
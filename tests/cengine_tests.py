@@ -0,0 +1,30 @@
+
+import random
+import itertools
+
+import cengine
+import parkersquare
+
+if not cengine.available:
+    print(f"Skipping: C engine not built at {cengine.LIBPATH}")
+    raise SystemExit(0)
+
+rng = random.Random(2025)
+
+# The C engine agrees with check_middle on random samples of candidates
+for start in [1, 10**6, 10**9]:
+    candidates = list(itertools.islice(parkersquare.iter_middle_range(start, start + 10**6), 20000))
+    sample = rng.sample(candidates, 1000)
+    assert cengine.check_many(sample) == [parkersquare.check_middle(fac) for fac in sample]
+
+# Including candidates with many border pairs
+primes = [5, 13, 17, 29, 37, 41, 53, 61]
+sample = []
+for _ in range(15):
+    fac = {p: rng.randint(1, 2) for p in rng.sample(primes, rng.randint(3, 5))}
+    sample.append(fac)
+assert cengine.check_many(sample) == [parkersquare.check_middle(fac) for fac in sample]
+
+# check_range gives the same answer with either engine
+assert parkersquare.check_range(10**5, 2 * 10**5, True, "c")[:4] == parkersquare.check_range(10**5, 2 * 10**5, True)[:4]
+assert cengine.check_many([]) == []
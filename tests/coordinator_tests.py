@@ -0,0 +1,82 @@
+
+import time
+import threading
+import multiprocessing as mp
+
+import coordinator
+import parkersquare
+
+# Expired leases are handed out again, and completing twice is harmless
+ledger = coordinator.Ledger(start=1, length=100, leasetime=-1)
+assert ledger.lease() == (1, 101)
+assert ledger.lease() == (1, 101)
+ledger.leasetime = 600
+assert ledger.lease() == (1, 101)
+assert ledger.lease() == (101, 201)
+assert ledger.complete(101, 201, 3, [])
+assert ledger.contiguous() == 1
+assert ledger.complete(1, 101, 2, [])
+assert not ledger.complete(1, 101, 2, [])
+assert ledger.contiguous() == 201 and ledger.count == 5
+
+# Renewing a lease keeps it from being handed out again, until it expires
+renewing = coordinator.Ledger(start=1, length=100, leasetime=600)
+assert renewing.lease() == (1, 101)
+renewing.leases[1] = (101, time.time() - 1)
+assert renewing.renew(1, 101)
+assert renewing.lease() == (101, 201)
+assert not renewing.renew(1, 50)
+assert renewing.complete(1, 101, 2, [])
+assert not renewing.renew(1, 101)
+
+# Intervals leased but not completed before a restart are reissued
+restored = coordinator.Ledger.fromdict({**ledger.todict(), "next": 401})
+assert restored.lease() == (201, 301)
+assert restored.lease() == (301, 401)
+assert restored.lease() == (401, 501)
+
+# Several worker processes against one coordinator cover a range exactly once
+if __name__ == '__main__':
+    # Requests are retried until the coordinator comes up
+    server = coordinator.CoordinatorServer(("127.0.0.1", 0), coordinator.Ledger(start=7))
+    address = server.server_address
+    server.server_close()
+    def startlater():
+        time.sleep(0.5)
+        server = coordinator.CoordinatorServer(address, coordinator.Ledger(start=7))
+        server.serve_forever()
+    threading.Thread(target=startlater, daemon=True).start()
+    assert coordinator._request(address, {"op": "lease"}, backoff=0.2)["lo"] == 7
+    try:
+        coordinator._request(("127.0.0.1", 1), {"op": "lease"}, retries=2, backoff=0.01)
+        assert False, "a coordinator that never answers should raise"
+    except OSError:
+        pass
+
+    # A worker renews its lease while checking a slow interval
+    ledger = coordinator.Ledger(start=10**9, length=300000, leasetime=0.3)
+    server = coordinator.CoordinatorServer(("127.0.0.1", 0), ledger)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    worker = mp.Process(target=coordinator.work, args=(*server.server_address, 1, "slow", 1))
+    worker.start()
+    while not ledger.leases:
+        time.sleep(0.01)
+    time.sleep(1.0)
+    if worker.is_alive():
+        assert ledger.lease() == (10**9 + 300000, 10**9 + 600000)
+    worker.join()
+    server.shutdown()
+    assert ledger.completed[0] == [10**9, 10**9 + 300000]
+
+    ledger = coordinator.Ledger(start=1, length=20000)
+    server = coordinator.CoordinatorServer(("127.0.0.1", 0), ledger)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    workers = [mp.Process(target=coordinator.work, args=(host, port, 2, f"w{i}", 3)) for i in range(3)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    server.shutdown()
+    assert ledger.completed == [[1, 180001]]
+    assert ledger.count == sum(1 for fac in parkersquare.iter_middle_range(1, 180001))
@@ -1,3 +1,4 @@
+import math
 import factors
 
 NUMTESTS=100
@@ -12,3 +13,83 @@ for n in range(1, NUMTESTS+1):
     assert len(pairs) == len(set(pairs))
     assert all(a**2 + b**2 == n for a,b in pairs)
 
+
+# Compare the segmented sieve against trial division
+def slowisprime(n):
+    return (n > 1) and all(n % d != 0 for d in range(2, math.isqrt(n) + 1))
+
+assert list(factors.primes(0, 5000)) == [n for n in range(5000) if slowisprime(n)]
+assert list(factors.primes(10**6, 10**6 + 2000)) == [n for n in range(10**6, 10**6 + 2000) if slowisprime(n)]
+assert list(factors.primes1mod4(7, 5000)) == [n for n in range(7, 5000) if slowisprime(n) and n % 4 == 1]
+assert all(factors.isprime(n) == slowisprime(n) for n in range(5000))
+assert [p for p,_ in zip(factors.primes(), range(1000))] == list(factors.primes(0, 7920))
+
+# Cross-check Cornacchia's algorithm against the exhaustive walk
+assert all(factors._primesumsquares(p) == factors._primesumsquares_walk(p) for p in factors.primes1mod4(0, 20000))
+assert all(a*a + b*b == p and 0 < a < b for p,(a,b) in factors.primesumsquares_range(10**9, 10**9 + 10000))
+
+# Compare the batch factorizer against factorizing one at a time
+assert list(factors.factorize_range(1, 3000)) == [(n, factors.factorize(n)) for n in range(1, 3000)]
+lo, hi = 10**7, 10**7 + 5000
+onemod4 = [(n, factors.factorize1mod4(n)) for n in range(lo, hi)]
+assert list(factors.factorize_range(lo, hi, only_1mod4=True)) == [(n,f) for n,f in onemod4 if f is not None]
+
+# Canonical pairs should be the first-octant reduction of all pairs
+for n in range(1, 3000):
+    fac = factors.factorize(n)
+    canonical = factors.getcanonicalsumsquares(fac)
+    pairs = {(min(abs(a),abs(b)), max(abs(a),abs(b))) for a,b in factors.getsumsquares(fac)}
+    assert len(canonical) == len(set(canonical))
+    assert set(canonical) == pairs
+
+# The sieved border pair counts match the factorizations
+lo, hi = 1, 30000
+ways = factors.numways_range(lo, hi)
+for n in range(lo, hi):
+    fac = factors.factorize1mod4(n) if n % 2 else None
+    expected = 0 if fac is None else (math.prod(2*e + 1 for e in fac.values()) - 1) // 2
+    assert ways[n - lo] == expected
+lo, hi = 10**12, 10**12 + 5000
+assert factors.numways_range(lo, hi).tolist() == [
+    0 if f is None else (math.prod(2*e + 1 for e in f.values()) - 1) // 2
+    for f in (factors.factorize1mod4(n) if n % 2 else None for n in range(lo, hi))]
+assert [n for n,f in factors.factorize_range(lo, hi, only_1mod4=True, minways=4)] == [
+    n for n,w in zip(range(lo, hi), factors.numways_range(lo, hi)) if w >= 4]
+
+# A shared prime table gives the same primes and sums of squares
+import os
+import tempfile
+import itertools
+import primetable
+path = os.path.join(tempfile.mkdtemp(), "primes.npy")
+assert primetable.build(path, 30000) == len(list(factors.primes1mod4(2, 30000)))
+expected = list(factors.primesumsquares_range(5, 60000))
+factors.use_primetable(path)
+assert list(factors.primesumsquares_range(5, 60000)) == expected
+assert list(factors.primes1mod4(100, 40000)) == [p for p,ab in expected if 100 <= p < 40000]
+assert list(itertools.islice(factors.primes1mod4(29990), 3)) == [p for p,ab in expected if p >= 29990][:3]
+assert factors._tablesumsquares(29989) == factors._primesumsquares(29989)
+assert factors._tablesumsquares(30013) is None
+assert all(factors.getcanonicalsumsquares(f) for f in [{29989:3, 5:2}])
+factors.use_primetable(None)
+
+# Miller-Rabin and Pollard's rho above LARGE agree with the sieve
+lo, hi = 2**40, 2**40 + 3000
+assert [(n, factors.factorize(n)) for n in range(lo, hi)] == list(factors.factorize_range(lo, hi))
+assert sorted(n for n in range(lo, hi) if factors.isprime(n)) == [n for n,f in factors.factorize_range(lo, hi) if f == {n:1}]
+# Strong pseudoprimes to several bases, and Mersenne primes
+assert not any(factors.isprime(n) for n in [3215031751, 2152302898747, 3474749660383,
+                                            341550071728321, 3825123056546413051, 2**89 + 1])
+assert all(factors.isprime(2**e - 1) for e in [31, 61, 89, 107, 127])
+fac = {5:8, 13:8, 17:8, 29:6, 2:1}
+assert factors.factorize(factors.getnum(fac)) == fac
+assert factors.factorize1mod4(factors.getnum(fac)) is None
+assert factors.factorize1mod4(factors.getnum(fac) // 2) == {5:8, 13:8, 17:8, 29:6}
+p, q = 1000000007, 100000000000000000039
+assert factors.factorize(p * q) == {p:1, q:1}
+assert factors.factorize1mod4(p * q) is None
+# A balanced semiprime of two 15 digit primes, and its square, whose root
+# is split once for both copies
+p, q = 100000000000097, 500000000000297
+assert factors.factorize1mod4(p * q) == {p:1, q:1}
+assert factors.factorize((p * q)**2) == {p:2, q:2}
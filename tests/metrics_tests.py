@@ -0,0 +1,61 @@
+
+import os
+import json
+import tempfile
+import urllib.request
+
+import metrics
+import parkersquare
+
+# Records from two workers are totalled, with a rate for each worker
+def record(pid, ways, seconds):
+    m = metrics.Metrics()
+    m.count("fit0", 3)
+    m.time("assembly", seconds)
+    m.numways.update(ways)
+    # Records arrive through JSON from worker processes
+    return json.loads(json.dumps({**m.todict(), "pid": pid, "rss": 1000 * pid}))
+
+path = os.path.join(tempfile.mkdtemp(), "metrics.jsonl")
+reporter = metrics.Reporter(path, port=0, interval=0)
+reporter.add(record(1, {2: 5, 4: 1}, 0.5), 100, 2.0)
+reporter.add(record(2, {4: 2}, 0.25), 300, 1.0)
+snap = reporter.snapshot()
+assert snap["counters"] == {"fit0": 6, "candidates": 400}
+assert snap["timers"] == {"assembly": 0.75}
+assert snap["numways"] == {2: 5, 4: 3}
+assert snap["workers"] == {
+    1: {"rate": 50.0, "candidates": 100, "seconds": 2.0, "rss": 1000},
+    2: {"rate": 300.0, "candidates": 300, "seconds": 1.0, "rss": 2000},
+}
+
+# Each write appends one JSON line with the totals and any extra state
+reporter.maybewrite({"next": 12345})
+reporter.maybewrite({"next": 23456})
+with open(path) as f:
+    lines = [json.loads(line) for line in f]
+assert [line["next"] for line in lines] == [12345, 23456]
+assert lines[0]["counters"] == {"fit0": 6, "candidates": 400}
+assert lines[0]["numways"] == {"2": 5, "4": 3}
+assert lines[0]["workers"]["2"]["rate"] == 300.0
+assert lines[1]["recentrate"] == 0.0
+
+# The same totals are served in the Prometheus text format
+text = reporter.prometheus()
+assert 'parkersquare_events_total{event="candidates"} 400' in text
+assert 'parkersquare_stage_seconds_total{stage="assembly"} 0.75' in text
+assert 'parkersquare_numways_total{numways="2"} 5' in text
+assert 'parkersquare_worker_candidates_per_second{pid="2"} 300.0' in text
+assert 'parkersquare_worker_rss_bytes{pid="1"} 1000' in text
+assert all(line.startswith("parkersquare_") for line in text.splitlines() if not line.startswith("#"))
+port = reporter.server.server_address[1]
+with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+    assert 'parkersquare_events_total{event="candidates"} 400' in response.read().decode()
+reporter.close()
+
+# The histogram of numways includes the numbers dropped for having too few
+metrics.enable()
+lo, hi, count, hits, elapsed, stats = parkersquare.check_range(10000, 50000)
+metrics.disable()
+assert min(stats["numways"]) == 1
+assert sum(n for ways,n in stats["numways"].items() if ways >= 4) == count
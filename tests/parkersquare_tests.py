@@ -0,0 +1,143 @@
+
+
+import backend
+import factors
+import parkersquare
+
+# iter_middle should produce exactly the candidates a linear scan would find,
+# in increasing order
+candidates = list(parkersquare.iter_middle(minways=0, stop=50000))
+scanned = [f for n in range(2, 50000) if (f := factors.factorize1mod4(n)) is not None]
+assert candidates == scanned
+candidates = list(parkersquare.iter_middle(start=10000, stop=50000))
+assert candidates == [f for f in scanned if factors.getnum(f) >= 10000 and parkersquare.getborderpairs(f) is not None]
+
+# Sieving an interval should find the same candidates as the heap
+assert list(parkersquare.iter_middle_range(10000, 50000)) == candidates
+lo, hi, count, hits, elapsed, stats = parkersquare.check_range(10000, 50000)
+assert count == len(candidates)
+assert all(fit > 0 for fac,fit,square in hits)
+
+# Shards split a range into contiguous pieces covering it exactly once
+pieces = [parkersquare.shard_range(10, 1000, i, 7) for i in range(7)]
+assert pieces[0][0] == 10 and pieces[-1][1] == 1000
+assert all(a[1] == b[0] for a,b in zip(pieces, pieces[1:]))
+assert parkersquare._parseint("5e7") == 50000000 and parkersquare._parseshard("3/16") == (3, 16)
+
+# A bounded search stops at the end of its range
+assert parkersquare.search(procs=1, start=10000, end=50000) is None
+
+# The depth first engine finds the same candidates and pairs as the heap
+bypairs = sorted((factors.getnum(f), p) for f,p in parkersquare.iter_border_pairs(50000, start=10000))
+assert bypairs == [(factors.getnum(f), parkersquare.getborderpairs(f)) for f in candidates]
+assert sorted(factors.getnum(f) for f,p in parkersquare.iter_border_pairs(50000, minways=0)) == [
+    factors.getnum(f) for f in scanned]
+assert parkersquare.check_range(10000, 50000, engine="tree")[2:4] == (len(candidates), hits)
+# Windows far from 1 agree with sieving, without walking every candidate below them
+far = 10**9
+bywindow = sorted(factors.getnum(f) for f,p in parkersquare.iter_border_pairs(far + 20000, start=far))
+assert bywindow == [factors.getnum(f) for f in parkersquare.iter_middle_range(far, far + 20000)]
+
+# The caches of sums of squares are bounded and count their hits
+caches = factors.cachestats()
+assert caches["primesumsquares"]["maxsize"] == factors.PRIME_CACHE_SIZE
+assert caches["primepowersumsquares"]["hits"] > 0
+
+# Compact pairs assemble the same squares as plain lists of pairs
+parkersquare.PairArray.SMALL = 0
+for fac in candidates[::50] + [{5:4, 13:3, 17:2, 29:2}, {5:2, 13:2, 17:2, 29:1, 37:1, 41:1}]:
+    pairs = parkersquare.getborderpairs(fac)
+    compact = parkersquare.getborderpairs(fac, compact=True)
+    assert isinstance(compact, parkersquare.PairArray) and compact == pairs
+    assert compact[len(pairs) - 1] == pairs[-1]
+    assert parkersquare.getbestsquare(compact) == parkersquare.getbestsquare(pairs)
+parkersquare.PairArray.SMALL = 24
+
+# Every executor checks the same candidates and stores the same results
+import os
+import tempfile
+import results
+rows = {}
+for executor in parkersquare.EXECUTORS:
+    path = os.path.join(tempfile.mkdtemp(), "results.db")
+    assert parkersquare.search(procs=2, start=10000, end=60000, resultsdb=path,
+                               storeall=True, executor=executor) is None
+    rows[executor] = results.query(path)
+assert len(rows["inline"]) == len(list(parkersquare.iter_middle_range(10000, 60000)))
+assert rows["process"] == rows["thread"] == rows["inline"]
+
+# Counting square cells finds the near misses of getbestcells, without
+# changing which candidates are hits otherwise
+lo, hi, count, hits, elapsed, stats = parkersquare.check_range(10000, 30000, mincells=6)
+assert count == len(list(parkersquare.iter_middle_range(10000, 30000)))
+expected = []
+for fac in parkersquare.iter_middle_range(10000, 30000):
+    cells, square = parkersquare.getbestcells(parkersquare.getborderpairs(fac))
+    if cells >= 6:
+        expected.append((fac, 0, square, cells))
+assert hits == expected != []
+assert all(sum(backend.is_square(n) for row in square for n in row) == cells for fac,fit,square,cells in hits)
+
+# Checkpoints round-trip through a temporary file that replaces the old one
+directory = tempfile.mkdtemp()
+checkpoint = os.path.join(directory, "checkpoint.json")
+parkersquare.save_checkpoint(checkpoint, {"count": 1, "next": 2, "hourglasses": 0})
+parkersquare.save_checkpoint(checkpoint, {"count": 3, "next": 40000, "hourglasses": 5})
+assert parkersquare.load_checkpoint(checkpoint) == {"count": 3, "next": 40000, "hourglasses": 5}
+assert os.listdir(directory) == ["checkpoint.json"]
+
+# Resuming starts exactly at the saved position, keeping the counts saved
+path = os.path.join(directory, "results.db")
+assert parkersquare.search(procs=1, end=60000, checkpoint=checkpoint, resume=True,
+                           resultsdb=path, storeall=True, executor="inline") is None
+state = parkersquare.load_checkpoint(checkpoint)
+assert state == {"count": 3 + len(list(parkersquare.iter_middle_range(40000, 60000))),
+                 "next": 60000, "hourglasses": 5}
+# and a search split by a checkpoint stores the same results as one without
+os.remove(checkpoint)
+path = os.path.join(directory, "split.db")
+for end in (35000, 60000):
+    parkersquare.search(procs=1, start=10000, end=end, checkpoint=checkpoint, resume=True,
+                        resultsdb=path, storeall=True, executor="inline")
+assert results.query(path) == rows["inline"]
+assert parkersquare.load_checkpoint(checkpoint)["count"] == len(rows["inline"])
+
+# A signal during an endless search stops it with a consistent checkpoint
+import signal
+import threading
+os.remove(checkpoint)
+threading.Timer(1.0, os.kill, (os.getpid(), signal.SIGTERM)).start()
+assert parkersquare.search(procs=1, start=10**6, checkpoint=checkpoint, interval=0.1,
+                           tasktime=0.05, executor="inline") is None
+state = parkersquare.load_checkpoint(checkpoint)
+assert state["next"] > 10**6 and state["hourglasses"] == 0
+assert state["count"] == len(list(parkersquare.iter_middle_range(10**6, state["next"])))
+
+# On a signal, the intervals already in the pool are finished and counted,
+# so the checkpoint ends exactly where the last interval handed out ended
+import time
+checkrange = parkersquare.check_range
+submitted = []
+def slowcheck(lo, hi, *args):
+    submitted.append(hi)
+    time.sleep(0.2)
+    return checkrange(lo, hi, *args)
+parkersquare.check_range = slowcheck
+os.remove(checkpoint)
+threading.Timer(1.0, os.kill, (os.getpid(), signal.SIGTERM)).start()
+assert parkersquare.search(procs=2, start=10**6, checkpoint=checkpoint, interval=0.1,
+                           executor="thread") is None
+state = parkersquare.load_checkpoint(checkpoint)
+assert state["next"] == max(submitted)
+assert state["count"] == len(list(parkersquare.iter_middle_range(10**6, state["next"])))
+# A second signal abandons the pool, still leaving a consistent checkpoint
+os.remove(checkpoint)
+submitted.clear()
+threading.Timer(1.0, os.kill, (os.getpid(), signal.SIGTERM)).start()
+threading.Timer(1.05, os.kill, (os.getpid(), signal.SIGTERM)).start()
+assert parkersquare.search(procs=2, start=10**6, checkpoint=checkpoint, interval=0.1,
+                           executor="thread") is None
+state = parkersquare.load_checkpoint(checkpoint)
+assert state["next"] < max(submitted)
+assert state["count"] == len(list(parkersquare.iter_middle_range(10**6, state["next"])))
+parkersquare.check_range = checkrange
@@ -0,0 +1,30 @@
+import math
+
+import parkersquare
+import progressions
+
+# Every progression of three squares centred in the range, exactly once
+lo, hi = 100, 3000
+found = sorted((int(c), int(x)) for cs,xs in progressions.iter_progressions(lo, hi) for c,x in zip(cs, xs))
+expected = sorted((c, x) for c in range(lo, hi) for x in range(1, c)
+                  if math.isqrt(2*c*c - x*x) ** 2 == 2*c*c - x*x)
+assert found == expected
+
+# The same candidates and results as check_range, whether or not the table
+# spills to disk
+for lo, hi in [(1, 30000), (10**6, 10**6 + 20000)]:
+    expected = parkersquare.check_range(lo, hi, keepall=True)
+    for memory in [2**22, 1000]:
+        result = progressions.check_progressions(lo, hi, keepall=True, memory=memory)
+        assert result[:4] == expected[:4]
+assert progressions.check_progressions(1, 20000, minways=3)[2] == \
+    len(list(parkersquare.iter_middle_range(1, 20000, minways=3)))
+
+# Narrow ranges far from 1 are refused, since enumerating progressions there
+# costs far more than sieving
+try:
+    progressions.check_progressions(10**12, 10**12 + 1000)
+except ValueError:
+    pass
+else:
+    raise AssertionError("expected a narrow range to be refused")
@@ -0,0 +1,34 @@
+import os
+import itertools
+import tempfile
+
+import numpy as np
+
+import residues
+
+# The tables agree with adding every pair of residues
+for m in list(range(1, 200)) + [5184]:
+    squares = {i * i % m for i in range(m)}
+    sums = {(i + j) % m for i,j in itertools.combinations_with_replacement(squares, 2)}
+    assert set(np.flatnonzero(residues.squares(m)).tolist()) == squares
+    assert set(np.flatnonzero(residues.sumsquares(m)).tolist()) == sums
+
+# The sieved ratios agree with the tables, in any piece of the range
+moduli, squareratio, sumratio = residues.scan_range(2, 2000)
+assert moduli.tolist() == list(range(2, 2000))
+for m,s,t in zip(moduli.tolist(), squareratio, sumratio):
+    assert s == np.count_nonzero(residues.squares(m)) / m
+    assert t == np.count_nonzero(residues.sumsquares(m)) / m
+piece = residues.scan_range(1500, 2000)
+assert all(np.array_equal(a[1498:], b) for a,b in zip((moduli, squareratio, sumratio), piece))
+assert residues.records(moduli, sumratio)[0].tolist() == [2, 4, 8, 16, 32, 64, 72, 144, 288, 576, 1152]
+
+# Primes whose squares can't sum to 0 mod p^2 except trivially
+assert [p for p in [2, 3, 5, 7, 11, 13] if residues.reducing(p)] == [2, 3, 7, 11]
+
+# Tables round trip through a file
+path = os.path.join(tempfile.mkdtemp(), "tables.npz")
+residues.save_tables(path, [144, 5184])
+tables = residues.load_tables(path)
+assert sorted(tables) == [144, 5184]
+assert np.array_equal(tables[5184][1], residues.sumsquares(5184))
@@ -0,0 +1,56 @@
+
+import os
+import tempfile
+
+import factors
+import parkersquare
+import results
+
+# Stored results come back by magnitude and fit, and storing twice is harmless
+path = os.path.join(tempfile.mkdtemp(), "results.db")
+checked = [parkersquare.check_middle(fac) for fac in parkersquare.iter_middle(stop=20000)]
+hourglass = ({5:1}, 1, [[1, 2, 3], [4, 5, 6], [7, 8, 9]])
+store = results.ResultStore(path)
+store.add(checked)
+store.add(checked[:10] + [hourglass])
+store.close()
+rows = results.query(path)
+assert [r[0] for r in rows] == sorted({r22 for r22,*_ in map(results.torow, checked + [hourglass])})
+assert all(r[2] == len(parkersquare.getborderpairs(factors.factorize(r[0]))) for r in rows if r[0] != 5)
+assert results.query(path, minfit=1) == [(5, "5^1", 1, 1, hourglass[2], None)]
+assert len(results.query(path, 10000, 15000)) == sum(1 for r in rows if 10000 <= r[0] < 15000)
+
+# Near misses carry their count of square cells, also in older databases
+import sqlite3
+path = os.path.join(tempfile.mkdtemp(), "old.db")
+conn = sqlite3.connect(path)
+conn.execute("CREATE TABLE results (r22 INTEGER PRIMARY KEY, factors TEXT NOT NULL,"
+             " numways INTEGER NOT NULL, fit INTEGER NOT NULL, square TEXT)")
+conn.execute("INSERT INTO results VALUES (5, '5^1', 1, 0, NULL)")
+conn.commit()
+conn.close()
+counted = [parkersquare.check_middle(fac, cells=True) for fac in parkersquare.iter_middle(start=20000, stop=40000)]
+store = results.ResultStore(path)
+store.add(counted)
+store.close()
+rows = results.query(path, lo=20000)
+assert [r[5] for r in rows] == [c for fac,fit,square,c in counted]
+assert results.query(path, hi=6) == [(5, "5^1", 1, 0, None, None)]
+assert results.query(path, mincells=6) == [r for r in rows if r[5] >= 6] != []
+
+# A failed write is raised from the next add() or close() instead of lost.
+# SQLite integers have 64 bits, so this r22 can't be stored.
+store = results.ResultStore(path)
+store.add([({5:30}, 0, None)])
+store.thread.join(timeout=10)
+try:
+    store.add(counted)
+    assert False, "add() should raise after a failed write"
+except results.ResultStoreException as e:
+    assert isinstance(e.__cause__, OverflowError)
+try:
+    store.close()
+    assert False, "close() should raise after a failed write"
+except results.ResultStoreException:
+    pass
+assert results.query(path, lo=20000) == rows